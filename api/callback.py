@@ -1,27 +1,15 @@
 from flask import Flask, Response, jsonify, render_template, redirect, request
-from base64 import b64decode
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
 
-from firebase_admin import credentials
-from firebase_admin import firestore
-import firebase_admin
-
-import os
-import json
 from util import spotify
 from util.logging_utils import setup_logging
+from util.token_store import get_token_store
 
 print("Starting Server")
 
-firebase_config = os.getenv("FIREBASE")
-firebase_dict = json.loads(b64decode(firebase_config))
-
-cred = credentials.Certificate(firebase_dict)
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+TOKEN_STORE = get_token_store()
 
 app = Flask(__name__)
 setup_logging(app)
@@ -42,8 +30,7 @@ def catch_all(path):
     spotify_user = spotify.get_user_profile(access_token)
     user_id = spotify_user["id"]
 
-    doc_ref = db.collection("users").document(user_id)
-    doc_ref.set(token_info)
+    TOKEN_STORE.save(user_id, token_info)
 
     rendered_data = {
         "uid": user_id,
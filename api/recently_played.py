@@ -1,19 +1,52 @@
 import html
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 from flask import Flask, Response, redirect, render_template, request
 
+from util.compression import choose_encoding, compress
 from util.firestore import get_firestore_db
 from util import spotify
+from util.http_cache import (
+    Result,
+    cache_control,
+    not_modified,
+    svg_result,
+    template_version,
+)
+from util.http_client import HTTP_POOL_SIZE
 from util.images import fetch_data_uri
 from util.logging_utils import setup_logging
+from util.play_history import PLAY_HISTORY
+from util.render_cache import fingerprint
+from util.thumbnails import THUMBNAIL_QUALITY, THUMBNAIL_SCALE
+from util.token_store import get_token_store
 
 app = Flask(__name__)
 setup_logging(app)
 
-CACHE_CONTROL = "public, max-age=60, stale-while-revalidate=30"
+RECENTLY_PLAYED_MAX_AGE = int(os.getenv("RECENTLY_PLAYED_MAX_AGE", "60"))
+CACHE_CONTROL = cache_control(RECENTLY_PLAYED_MAX_AGE)
+# Covers are drawn at 56px by recently_played_spotify.svg.j2
+COVER_SIZE = 56
+TEMPLATE_VERSION = template_version(
+    os.path.join(app.root_path, app.template_folder),
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_SCALE,
+)
+# Seconds a render waits for all covers; late ones are drawn as placeholders
+COVER_FETCH_DEADLINE = float(os.getenv("COVER_FETCH_DEADLINE", "3"))
+COVER_POOL = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
+
+TOKEN_STORE = get_token_store()
+
+# Used when a request has no ?uid (single-user deployments)
+DEFAULT_UID = os.getenv("DEFAULT_UID", "")
+DEFAULT_UID_TTL = int(os.getenv("DEFAULT_UID_TTL", "300"))
+_default_uid_cache: List[Any] = ["", 0.0]
 
 
 def humanize_ago(dt: datetime) -> str:
@@ -51,49 +84,81 @@ def parse_limit(value: Any) -> int:
     return max(1, min(num, 10))
 
 
-def _svg_response(svg: str) -> Response:
-    etag = f'W/"{hash(svg)}"'
-    headers = {
-        "Content-Type": "image/svg+xml; charset=utf-8",
-        "ETag": etag,
-        "Cache-Control": CACHE_CONTROL,
-    }
-    if request.headers.get("If-None-Match") == etag:
-        return Response(status=304, headers=headers)
-    return Response(svg, headers=headers)
+def _not_modified(key: str, if_none_match: Optional[str]) -> Optional[Result]:
+    return not_modified(key, CACHE_CONTROL, if_none_match)
+
+
+def _result(
+    key: Optional[str],
+    svg: str,
+    if_none_match: Optional[str],
+    accept_encoding: Optional[str],
+) -> Result:
+    """Status, headers and body answering with ``svg``.
+
+    Without a key (errors, cards missing covers) the card is tagged by its
+    content.
+    """
+    if key is None:
+        key = fingerprint(svg)
+        result = _not_modified(key, if_none_match)
+        if result is not None:
+            return result
+    body = svg.encode()
+    encoding = choose_encoding(body, accept_encoding)
+    return svg_result(key, compress(body, encoding), CACHE_CONTROL, encoding)
+
+
+def _respond(result: Result) -> Response:
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+
+def _parse_params(args) -> Tuple[str, int, Optional[int]]:
+    theme = (args.get("theme") or "default").lower()
+
+    def clamp(v, lo, hi):
+        return max(lo, min(hi, v))
+
+    try:
+        limit = clamp(int(args.get("limit", 5)), 1, 10)
+    except Exception:
+        limit = 5
+
+    try:
+        width = int(args.get("width")) if args.get("width") else None
+    except Exception:
+        width = None
+    return theme, limit, width
 
 
-def _get_user_id(db) -> str:
-    uid = request.args.get("uid") or request.args.get("user")
+def _uid_from_args(args) -> str:
+    uid = args.get("uid") or args.get("user")
     if uid:
         return "".join(ch for ch in uid if ch.isalnum())
-    users = list(db.collection("users").stream())
-    if len(users) == 1:
-        return users[0].id
     return ""
 
 
-def _get_tokens(db, uid: str) -> Dict[str, Any]:
-    doc = db.collection("users").document(uid).get()
-    if not doc.exists:
-        raise RuntimeError("user not found")
-    return doc.to_dict()
+def _get_user_id(args) -> str:
+    return _uid_from_args(args) or _default_user_id()
 
 
-def _ensure_access_token(db, uid: str, info: Dict[str, Any]) -> str:
-    now = int(time.time())
-    if info.get("token_expired_timestamp", 0) <= now:
-        refreshed = spotify.refresh_token(info["refresh_token"])
-        info.update(
-            {
-                "access_token": refreshed["access_token"],
-                "token_expired_timestamp": now
-                + int(refreshed.get("expires_in", 3600))
-                - 30,
-            }
-        )
-        db.collection("users").document(uid).set(info, merge=True)
-    return info["access_token"]
+def _default_user_id() -> str:
+    """Return the only user of a single-user deployment, or ``""``.
+
+    ``DEFAULT_UID`` skips Firestore entirely; otherwise at most two documents
+    are read and the answer is cached for ``DEFAULT_UID_TTL`` seconds.
+    """
+    if DEFAULT_UID:
+        return DEFAULT_UID
+    now = time.time()
+    cached_uid, expires_at = _default_uid_cache
+    if expires_at > now:
+        return cached_uid
+    users = list(get_firestore_db().collection("users").limit(2).stream())
+    uid = users[0].id if len(users) == 1 else ""
+    _default_uid_cache[:] = [uid, now + DEFAULT_UID_TTL]
+    return uid
 
 
 def _render_recent(items: List[Dict[str, Any]]) -> str:
@@ -120,87 +185,146 @@ def recently_played_redirect():
     return redirect("/api/recently-played", code=301)
 
 
-@app.route("/api/recently-played", methods=["GET"])
-def recently_played_view():
-    theme = (request.args.get("theme") or "default").lower()
+def _fetch_recently_played(uid: str, limit: int) -> Dict[str, Any]:
+    def fetch(**kwargs):
+        token = TOKEN_STORE.get_access_token(uid)
+        if token is None:
+            raise RuntimeError("user not found")
+        spotify.acquire_quota(uid)
+        try:
+            return spotify.get_recently_played(token, **kwargs)
+        except spotify.InvalidTokenError:
+            token = TOKEN_STORE.refresh(uid)
+            if token is None:
+                raise
+            return spotify.get_recently_played(token, **kwargs)
+
+    return {"items": PLAY_HISTORY.refresh(uid, fetch)[:limit]}
+
+
+def _tracks(raw_items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    tracks: List[Dict[str, Any]] = []
+    for item in raw_items:
+        track = item.get("track", {})
+        artists = [a.get("name", "") for a in track.get("artists", []) or []]
+        images = track.get("album", {}).get("images", []) or []
+        cover = spotify.smallest_image(images)
+        tracks.append(
+            {
+                "name": track.get("name", ""),
+                "artists": artists,
+                "cover": cover,
+                "images": images,
+                "played_at": item.get("played_at", ""),
+            }
+        )
+    return tracks
 
-    def clamp(v, lo, hi):
-        return max(lo, min(hi, v))
 
-    try:
-        limit = clamp(int(request.args.get("limit", 5)), 1, 10)
-    except Exception:
-        limit = 5
+def _is_spotify_theme(theme: str) -> bool:
+    return theme in ("spotify", "sp")
 
-    try:
-        width = int(request.args.get("width")) if request.args.get("width") else None
-    except Exception:
-        width = None
-    db = get_firestore_db()
-    uid = _get_user_id(db)
+
+def _cover_url(t: Dict[str, Any]) -> Optional[str]:
+    return t.get("cover") or (
+        t.get("images", [{}])[-1].get("url") if t.get("images") else None
+    )
+
+
+def _when(t: Dict[str, Any]) -> str:
+    played_at = t.get("played_at")
+    return humanize_ago(parse_iso_z(played_at)) if played_at else ""
+
+
+def _recent_key(
+    theme: str, width: Optional[int], raw_items: List[Dict[str, Any]]
+) -> str:
+    """Fingerprint of the card, known before any cover is fetched."""
+    spotify_theme = _is_spotify_theme(theme)
+    rows = [
+        (
+            t["name"],
+            t["artists"],
+            [image.get("url") for image in t["images"]],
+            t["played_at"],
+            _when(t) if spotify_theme else None,
+        )
+        for t in _tracks(raw_items)
+    ]
+    return fingerprint(
+        TEMPLATE_VERSION, spotify_theme, width if spotify_theme else None, rows
+    )
+
+
+def _is_complete(tracks: List[Dict[str, Any]], covers: List[Optional[str]]) -> bool:
+    return all(cover or not _cover_url(t) for t, cover in zip(tracks, covers))
+
+
+def _fetch_covers(tracks: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """Download the covers of ``tracks`` concurrently as data URIs.
+
+    Covers not fetched within ``COVER_FETCH_DEADLINE`` are ``None``; their
+    downloads keep running and land in the image cache for the next render.
+    """
+    futures = [
+        COVER_POOL.submit(fetch_data_uri, url, size=COVER_SIZE) if url else None
+        for url in map(_cover_url, tracks)
+    ]
+    wait([f for f in futures if f], timeout=COVER_FETCH_DEADLINE)
+    return [f.result() if f and f.done() else None for f in futures]
+
+
+def _render_spotify(
+    tracks: List[Dict[str, Any]], covers: List[Optional[str]], width: Optional[int]
+) -> str:
+    items: List[Dict[str, Any]] = []
+    for t, cover_data in zip(tracks, covers):
+        items.append(
+            {
+                "title": t["name"],
+                "artist": ", ".join(t.get("artists", [])),
+                "cover": cover_data,
+                "when": _when(t),
+            }
+        )
+    template = "recently_played_spotify.svg.j2"
+    return render_template(template, items=items, W=(width or 920))
+
+
+def _error_message(exc: Exception) -> str:
+    if isinstance(exc, spotify.RateLimitError):
+        return "Spotify rate limit"
+    if isinstance(exc, spotify.SpotifyTimeoutError):
+        return "Spotify timeout"
+    return str(exc)
+
+
+@app.route("/api/recently-played", methods=["GET"])
+def recently_played_view():
+    theme, limit, width = _parse_params(request.args)
+    if_none_match = request.headers.get("If-None-Match")
+    accept_encoding = request.headers.get("Accept-Encoding")
+    uid = _get_user_id(request.args)
     if not uid:
-        return _svg_response(_render_error("Please provide ?uid=<spotify id>"))
+        svg = _render_error("Please provide ?uid=<spotify id>")
+        return _respond(_result(None, svg, if_none_match, accept_encoding))
     try:
-        info = _get_tokens(db, uid)
-        token = _ensure_access_token(db, uid, info)
-        try:
-            data = spotify.get_recently_played(token, limit=limit)
-        except spotify.InvalidTokenError:
-            refreshed = spotify.refresh_token(info["refresh_token"])
-            info.update(
-                {
-                    "access_token": refreshed["access_token"],
-                    "token_expired_timestamp": int(time.time())
-                    + int(refreshed.get("expires_in", 3600))
-                    - 30,
-                }
-            )
-            db.collection("users").document(uid).set(info, merge=True)
-            data = spotify.get_recently_played(info["access_token"], limit=limit)
-
+        data = _fetch_recently_played(uid, limit)
         raw_items = data.get("items", []) if data else []
-
-        tracks: List[Dict[str, Any]] = []
-        for item in raw_items:
-            track = item.get("track", {})
-            artists = [a.get("name", "") for a in track.get("artists", []) or []]
-            images = track.get("album", {}).get("images", []) or []
-            cover = spotify.smallest_image(images)
-            tracks.append(
-                {
-                    "name": track.get("name", ""),
-                    "artists": artists,
-                    "cover": cover,
-                    "images": images,
-                    "played_at": item.get("played_at", ""),
-                }
-            )
-
-        if theme in ("spotify", "sp"):
-            items: List[Dict[str, Any]] = []
-            for t in tracks[:limit]:
-                played_at = t.get("played_at")
-                when = humanize_ago(parse_iso_z(played_at)) if played_at else ""
-                cover_url = t.get("cover") or (
-                    t.get("images", [{}])[-1].get("url") if t.get("images") else None
-                )
-                cover_data = fetch_data_uri(cover_url) if cover_url else None
-                items.append(
-                    {
-                        "title": t["name"],
-                        "artist": ", ".join(t.get("artists", [])),
-                        "cover": cover_data,
-                        "when": when,
-                    }
-                )
-            template = "recently_played_spotify.svg.j2"
-            svg = render_template(template, items=items, W=(width or 920))
+        key = _recent_key(theme, width, raw_items)
+        result = _not_modified(key, if_none_match)
+        if result is not None:
+            return _respond(result)
+
+        if _is_spotify_theme(theme):
+            tracks = _tracks(raw_items)[:limit]
+            covers = _fetch_covers(tracks)
+            svg = _render_spotify(tracks, covers, width)
+            if not _is_complete(tracks, covers):
+                key = None
         else:
             svg = _render_recent(raw_items)
-        return _svg_response(svg)
-    except spotify.RateLimitError:
-        return _svg_response(_render_error("Spotify rate limit"))
-    except spotify.SpotifyTimeoutError:
-        return _svg_response(_render_error("Spotify timeout"))
+        return _respond(_result(key, svg, if_none_match, accept_encoding))
     except Exception as exc:  # noqa: BLE001
-        return _svg_response(_render_error(str(exc)))
+        svg = _render_error(_error_message(exc))
+        return _respond(_result(None, svg, if_none_match, accept_encoding))
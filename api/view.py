@@ -2,57 +2,108 @@ from flask import Flask, Response, jsonify, render_template, redirect, request
 from base64 import b64decode, b64encode
 from dotenv import load_dotenv, find_dotenv
 
-from util.firestore import get_firestore_db
+from util.compression import choose_encoding, compress
+from util.http_client import HTTP_POOL_SIZE
+from util.http_cache import (
+    cache_control,
+    not_modified,
+    svg_result,
+    template_version,
+)
+from util.images import load_image
 from util.logging_utils import setup_logging
+from util.minify import MinifyingLoader
+from util.now_playing_cache import NowPlayingCache
+from util.palette import PALETTE_EXTRACTOR, PALETTE_SAMPLE_SIZE, extract_palette
+from util.play_history import PLAY_HISTORY
+from util.render_cache import (
+    RENDER_PROGRESS_BUCKET_MS,
+    RenderCache,
+    bucket_progress,
+    fingerprint,
+)
+from util.themes import (
+    fill_skeleton,
+    get_theme,
+    slot,
+    split_skeleton,
+    theme_name,
+)
+from util.thumbnails import THUMBNAIL_QUALITY, THUMBNAIL_SCALE
+from util.token_refresher import TOKEN_REFRESHER_ENABLED, TokenRefresher
+from util.token_store import get_token_store
 
 load_dotenv(find_dotenv())
 
-from sys import getsizeof
-from PIL import Image, ImageFile
-
-from time import time
-
-import io
+import os
+from concurrent.futures import ThreadPoolExecutor
 from util import spotify
 import random
-import requests
 import functools
-import colorgram
 import math
 import html
 
-ImageFile.LOAD_TRUNCATED_IMAGES = True
-
 print("Starting Server")
 
-db = get_firestore_db()
-CACHE_TOKEN_INFO = {}
+TOKEN_STORE = get_token_store()
+TOKEN_REFRESHER = TokenRefresher(TOKEN_STORE.cache.get, TOKEN_STORE.refresh)
+NOW_PLAYING_CACHE = NowPlayingCache()
+RENDER_CACHE = RenderCache()
+
+# Fetch recently played alongside now playing instead of after it. Saves a
+# round trip when nothing is playing at the cost of an extra API call.
+PREFETCH_RECENTLY_PLAYED = os.getenv("PREFETCH_RECENTLY_PLAYED", "false") == "true"
+PREFETCH_POOL = ThreadPoolExecutor(max_workers=HTTP_POOL_SIZE)
+# Seconds browsers and the CDN may reuse a card: a playing track's card
+# until the track ends (at least CARD_MAX_AGE, at most
+# CARD_NOW_PLAYING_MAX_AGE), offline and recently played cards for
+# CARD_IDLE_MAX_AGE
+CARD_MAX_AGE = int(os.getenv("CARD_MAX_AGE", "1"))
+CARD_NOW_PLAYING_MAX_AGE = int(os.getenv("CARD_NOW_PLAYING_MAX_AGE", "900"))
+CARD_IDLE_MAX_AGE = int(os.getenv("CARD_IDLE_MAX_AGE", "60"))
+# Cards with a progress bar (apple) animate it from when they are loaded, so
+# a cached copy lags by its age: they expire CARD_PROGRESS_MARGIN seconds
+# before the track ends and after at most CARD_PROGRESS_MAX_AGE seconds
+CARD_PROGRESS_MARGIN = int(os.getenv("CARD_PROGRESS_MARGIN", "5"))
+CARD_PROGRESS_MAX_AGE = int(os.getenv("CARD_PROGRESS_MAX_AGE", "30"))
+# Strip indentation and compact the CSS of the card templates when loaded
+MINIFY_TEMPLATES = os.getenv("MINIFY_TEMPLATES", "true") == "true"
+# Distinct bar animation durations per card
+BAR_PATTERN = 20
+# The offline card picks a random track among this many recent plays
+RECENT_PLAYS_PICK = 5
+
+INVALID_TOKEN_MESSAGE = "Error: Invalid Spotify access_token or refresh_token. Possibly the token revoked. Please re-login at https://github.com/kittinan/spotify-github-profile"
 
 app = Flask(__name__)
 setup_logging(app)
+if MINIFY_TEMPLATES:
+    app.jinja_loader = MinifyingLoader(app.jinja_loader)
+TEMPLATE_VERSION = template_version(
+    os.path.join(app.root_path, app.template_folder),
+    MINIFY_TEMPLATES,
+    BAR_PATTERN,
+    RENDER_PROGRESS_BUCKET_MS,
+    THUMBNAIL_QUALITY,
+    THUMBNAIL_SCALE,
+    PALETTE_EXTRACTOR,
+    PALETTE_SAMPLE_SIZE,
+)
 
 
 @functools.lru_cache(maxsize=128)
 def generate_css_bar(num_bar=75):
-    css_bar = ""
-    left = 1
-    for i in range(1, num_bar + 1):
-
-        anim = random.randint(350, 500)
-        css_bar += (
-            ".bar:nth-child({})  {{ left: {}px; animation-duration: {}ms; }}".format(
-                i, left, anim
-            )
+    # Bars are placed by the theme markup; animation durations repeat every
+    # BAR_PATTERN bars, which keeps the rules few and the motion irregular
+    period = min(num_bar, BAR_PATTERN)
+    # Seeded so every worker renders, and tags, the same card
+    rng = random.Random(num_bar)
+    return "".join(
+        ".bar:nth-child({}n+{}){{animation-duration:{}ms}}".format(
+            period, i, rng.randint(350, 500)
         )
-        left += 4
-
-    return css_bar
-
-
-@functools.lru_cache(maxsize=128)
-def load_image(url):
-    resposne = requests.get(url)
-    return resposne.content
+        for i in range(1, period + 1)
+    )
 
 
 def to_img_b64(content):
@@ -116,52 +167,29 @@ def calculate_progress_data(progress_ms, duration_ms):
     }
 
 
-# @functools.lru_cache(maxsize=128)
-def make_svg(
-    artist_name,
-    song_name,
-    img,
+@functools.lru_cache(maxsize=256)
+def card_skeleton(
+    theme,
     is_now_playing,
     cover_image,
-    theme,
-    bar_color,
     show_offline,
-    background_color,
     mode,
-    progress_ms=None,
-    duration_ms=None,
+    has_song,
+    has_img,
+    has_progress,
+    animate_progress=False,
 ):
-    height = 0
-    num_bar = 75
+    """Render the invariant markup of a card once, with slots for the rest.
 
-    # Sanitize input
-    artist_name = encode_html_entities(artist_name)
-    song_name = encode_html_entities(song_name)
-
-    if theme == "compact":
-        if cover_image:
-            height = 400
-        else:
-            height = 100
-    elif theme == "natemoo-re":
-        height = 84
-        num_bar = 100
-    elif theme == "novatorem":
-        height = 100
-        num_bar = 100
-    elif theme == "apple":
-        height = 534
-        num_bar = 0
-    else:
-        if cover_image:
-            height = 445
-        else:
-            height = 145
+    The arguments are everything the templates branch on; artist, song,
+    cover, colors and progress are left as slots for ``fill_skeleton``.
+    """
+    meta = get_theme(theme)
 
     if is_now_playing:
         title_text = "Now playing"
-        content_bar = "".join(["<div class='bar'></div>" for i in range(num_bar)])
-        css_bar = generate_css_bar(num_bar)
+        content_bar = meta.content_bar
+        css_bar = generate_css_bar(meta.num_bar)
     elif show_offline:
         title_text = "Not playing"
         content_bar = ""
@@ -169,249 +197,402 @@ def make_svg(
     else:
         title_text = "Recently played"
         content_bar = ""
-        css_bar = generate_css_bar(num_bar)
+        css_bar = generate_css_bar(meta.num_bar)
 
-    # Calculate progress data for Apple theme
     progress_data = {}
-    if theme == "apple" and duration_ms is not None:
-        if is_now_playing and progress_ms is not None:
-            # Currently playing - show real progress
-            progress_data = calculate_progress_data(progress_ms, duration_ms)
-        else:
-            # Recently played - show 0 progress but real duration
-            progress_data = calculate_progress_data(0, duration_ms)
+    if has_progress:
+        progress_data = {
+            "progress_percentage": slot("progress_percentage"),
+            "current_time": slot("current_time"),
+            "remaining_time": slot("remaining_time"),
+        }
+        if animate_progress:
+            progress_data["remaining_seconds"] = slot("remaining_seconds")
 
     rendered_data = {
-        "height": height,
-        "num_bar": num_bar,
+        "height": meta.card_height(cover_image),
+        "num_bar": meta.num_bar,
         "content_bar": content_bar,
         "css_bar": css_bar,
         "title_text": title_text,
-        "artist_name": artist_name,
-        "song_name": song_name,
-        "img": img,
+        "artist_name": slot("artist_name"),
+        "song_name": slot("song_name") if has_song else "",
+        "img": slot("img") if has_img else "",
         "cover_image": cover_image,
-        "bar_color": bar_color,
-        "background_color": background_color,
+        "bar_color": slot("bar_color"),
+        "background_color": slot("background_color"),
         "mode": mode,
         "is_now_playing": is_now_playing,
         "progress_data": progress_data,
+        "animate_progress": animate_progress,
     }
 
-    return render_template(f"spotify.{theme}.html.j2", **rendered_data)
-
+    return split_skeleton(render_template(meta.template, **rendered_data))
 
-def get_cache_token_info(uid):
-    global CACHE_TOKEN_INFO
 
-    token_info = CACHE_TOKEN_INFO.get(uid, None)
+def make_svg(
+    artist_name,
+    song_name,
+    img,
+    is_now_playing,
+    cover_image,
+    theme,
+    bar_color,
+    show_offline,
+    background_color,
+    mode,
+    progress_ms=None,
+    duration_ms=None,
+    is_playing=True,
+):
+    # Sanitize input
+    artist_name = encode_html_entities(artist_name)
+    song_name = encode_html_entities(song_name)
 
-    if type(token_info) == dict:
-        current_ts = int(time())
-        expired_ts = token_info.get("expired_ts")
-        if expired_ts is None or current_ts >= expired_ts:
-            return None
+    # Calculate progress data for Apple theme
+    progress_data = {}
+    if get_theme(theme).progress and duration_ms is not None:
+        if is_now_playing and progress_ms is not None:
+            # Currently playing - show real progress
+            progress_data = calculate_progress_data(progress_ms, duration_ms)
+        else:
+            # Recently played - show 0 progress but real duration
+            progress_data = calculate_progress_data(0, duration_ms)
 
-    return token_info
+    # The client moves the bar to the end of the track; the time labels
+    # would not follow it, so the template leaves them out
+    animate_progress = bool(progress_data) and is_now_playing and is_playing
+    if animate_progress:
+        remaining_ms = max(0, duration_ms - (progress_ms or 0))
+        progress_data["remaining_seconds"] = f"{remaining_ms / 1000:g}"
 
+    skeleton = card_skeleton(
+        theme,
+        is_now_playing,
+        cover_image,
+        show_offline,
+        mode,
+        bool(song_name),
+        bool(img),
+        bool(progress_data),
+        animate_progress,
+    )
+    return fill_skeleton(
+        skeleton,
+        {
+            "artist_name": artist_name,
+            "song_name": song_name,
+            "img": img,
+            "bar_color": bar_color,
+            "background_color": background_color,
+            **progress_data,
+        },
+    )
 
-def delete_cache_token_info(uid):
-    global CACHE_TOKEN_INFO
 
-    if uid in CACHE_TOKEN_INFO:
-        del CACHE_TOKEN_INFO[uid]
+def mark_active(uid):
+    if TOKEN_REFRESHER_ENABLED:
+        TOKEN_REFRESHER.start()
+        TOKEN_REFRESHER.touch(uid)
 
 
 def get_access_token(uid):
-    global CACHE_TOKEN_INFO
+    mark_active(uid)
 
-    # Load token from cache memory
-    token_info = get_cache_token_info(uid)
+    return TOKEN_STORE.get_access_token(uid)
 
-    if token_info is None:
-        # Load from firebase
-        doc_ref = db.collection("users").document(uid)
-        doc = doc_ref.get()
 
-        if not doc.exists:
-            print("not exist data in firebase: {}".format(uid))
-            return None
+def song_info_from_now_playing(data):
+    item = data["item"]
+    item["currently_playing_type"] = data["currently_playing_type"]
 
-        token_info = doc.to_dict()
+    # Paused tracks keep their progress until playback resumes
+    item["is_playing"] = data.get("is_playing", True)
 
-        CACHE_TOKEN_INFO[uid] = token_info
+    # Extract progress data for currently playing tracks
+    progress_ms = data.get("progress_ms")
+    duration_ms = None
+    if item and item.get("duration_ms"):
+        duration_ms = item["duration_ms"]
 
-    current_ts = int(time())
-    access_token = token_info.get("access_token", None)
-    print(access_token)
+    return item, True, progress_ms, duration_ms
 
-    # Check token expired
-    expired_ts = token_info.get("expired_ts")
-    if expired_ts is None or current_ts >= expired_ts:
-        # Refresh token
-        refresh_token = token_info["refresh_token"]
 
-        new_token = spotify.refresh_token(refresh_token)
+def song_info_from_recently_played(recent_plays):
+    items = (recent_plays or {}).get("items", [])
+    size_recent_play = len(items)
 
-        # Handle refresh token revoke
-        if new_token.get("error") == "invalid_grant":
-            # Delete token in firebase
-            doc_ref = db.collection("users").document(uid)
-            doc_ref.delete()
+    # Handle empty recently play, should offline
+    if size_recent_play == 0:
+        return None, False, None, None
 
-            # Delete token in memory cache
-            delete_cache_token_info(uid)
-            return None
+    idx = random.randint(0, size_recent_play - 1)
+    item = items[idx]["track"]
+    item["currently_playing_type"] = "track"
 
-        expired_ts = int(time()) + new_token["expires_in"]
-        update_data = {
-            "access_token": new_token["access_token"],
-            "expired_ts": expired_ts,
-        }
-        doc_ref = db.collection("users").document(uid)
-        doc_ref.update(update_data)
+    # No progress data for recently played tracks, but get duration
+    duration_ms = None
+    if item and item.get("duration_ms"):
+        duration_ms = item["duration_ms"]
 
-        access_token = new_token["access_token"]
+    return item, False, None, duration_ms
 
-        # Save in memory cache
-        CACHE_TOKEN_INFO[uid] = update_data
 
-    return access_token
+def degraded_song_info(uid):
+    """Song info while Spotify is unavailable: last snapshot, else offline."""
+    data = NOW_PLAYING_CACHE.get(uid, stale=True)
+    if data:
+        return song_info_from_now_playing(data)
+    return None, False, None, None
+
+
+def should_prefetch_recently_played(uid, show_offline):
+    # Speculative: the answer is thrown away if something is playing
+    return (
+        PREFETCH_RECENTLY_PLAYED
+        and not show_offline
+        and not PLAY_HISTORY.is_fresh(uid)
+        and spotify.QUOTA.try_acquire(uid, speculative=True)
+    )
+
+
+def get_recent_plays(uid, access_token, acquire=True):
+    """Recently played of ``uid`` from the local history, updated if stale."""
+
+    def fetch(**kwargs):
+        if acquire:
+            spotify.acquire_quota(uid)
+        return spotify.get_recently_played(access_token, **kwargs)
+
+    return {"items": PLAY_HISTORY.refresh(uid, fetch)[:RECENT_PLAYS_PICK]}
 
 
 def get_song_info(uid, show_offline):
     access_token = get_access_token(uid)
 
-    item = None
-    is_now_playing = False
-    progress_ms = None
-    duration_ms = None
-
     # Handle refrest_token revoke or invalid token
     if access_token is None:
         raise spotify.InvalidTokenError("Invalid Spotify access_token or refresh_token")
 
-    data = spotify.get_now_playing(access_token)
+    recent_future = None
+    try:
+        data = NOW_PLAYING_CACHE.get(uid)
+        if data is None:
+            if should_prefetch_recently_played(uid, show_offline):
+                recent_future = PREFETCH_POOL.submit(
+                    get_recent_plays, uid, access_token, False
+                )
+            spotify.acquire_quota(uid)
+            try:
+                data = spotify.get_now_playing(access_token)
+            except spotify.InvalidTokenError:
+                # Rejected before its expiry: refresh once, as recently-played does
+                access_token = TOKEN_STORE.refresh(uid)
+                if access_token is None:
+                    raise
+                data = spotify.get_now_playing(access_token)
+            NOW_PLAYING_CACHE.set(uid, data)
+
+        if data:
+            return song_info_from_now_playing(data)
+        elif show_offline:
+            return None, False, None, None
 
-    if data:
-        item = data["item"]
-        item["currently_playing_type"] = data["currently_playing_type"]
-        is_now_playing = True
-
-        # Extract progress data for currently playing tracks
-        progress_ms = data.get("progress_ms")
-        if item and item.get("duration_ms"):
-            duration_ms = item["duration_ms"]
-    elif show_offline:
-        return None, False, None, None
-    else:
-        recent_plays = spotify.get_recently_played(access_token)
-        size_recent_play = len(recent_plays["items"])
+        if recent_future is not None:
+            recent_plays = recent_future.result()
+        else:
+            recent_plays = get_recent_plays(uid, access_token)
+    except spotify.UNAVAILABLE_ERRORS:
+        return degraded_song_info(uid)
+    finally:
+        if recent_future is not None:
+            recent_future.cancel()
+    return song_info_from_recently_played(recent_plays)
 
-        # Handle empty recently play, should offline
-        if size_recent_play == 0:
-            return None, False, None, None
 
-        idx = random.randint(0, size_recent_play - 1)
-        item = recent_plays["items"][idx]["track"]
-        item["currently_playing_type"] = "track"
-        is_now_playing = False
-        # No progress data for recently played tracks, but get duration
-        if item and item.get("duration_ms"):
-            duration_ms = item["duration_ms"]
+def parse_card_params(args):
+    return {
+        "uid": args.get("uid"),
+        "cover_image": args.get("cover_image", default="true") == "true",
+        "is_redirect": args.get("redirect", default="false") == "true",
+        "theme": theme_name(args.get("theme", default="default")),
+        "bar_color": args.get("bar_color", default="53b14f"),
+        "background_color": args.get("background_color", default="121212"),
+        "is_bar_color_from_cover": args.get("bar_color_cover", default="false")
+        == "true",
+        "show_offline": args.get("show_offline", default="false") == "true",
+        "interchange": args.get("interchange", default="false") == "true",
+        "mode": args.get("mode", default="light"),
+    }
 
-    return item, is_now_playing, progress_ms, duration_ms
 
+def is_offline(params, item, is_now_playing):
+    return (params["show_offline"] and not is_now_playing) or (item is None)
 
-@app.route("/", defaults={"path": ""})
-@app.route("/<path:path>")
-def catch_all(path):
-    uid = request.args.get("uid")
-    cover_image = request.args.get("cover_image", default="true") == "true"
-    is_redirect = request.args.get("redirect", default="false") == "true"
-    theme = request.args.get("theme", default="default")
-    bar_color = request.args.get("bar_color", default="53b14f")
-    background_color = request.args.get("background_color", default="121212")
-    is_bar_color_from_cover = (
-        request.args.get("bar_color_cover", default="false") == "true"
+
+def cover_size(theme):
+    """CSS pixels the cover is drawn at by ``theme``."""
+    return get_theme(theme).cover_size
+
+
+def get_cover_url(item):
+    currently_playing_type = item.get("currently_playing_type", "track")
+
+    if currently_playing_type == "track":
+        return item["album"]["images"][1]["url"]
+    elif currently_playing_type == "episode":
+        return item["images"][1]["url"]
+
+    return None
+
+
+def card_key(params, item, is_now_playing, progress_ms, duration_ms):
+    """Fingerprint of everything ``render_card`` draws, or ``None``.
+
+    Only the apple theme draws progress, so other themes share one entry
+    for the whole track.
+    """
+    if is_offline(params, item, is_now_playing):
+        track = "offline"
+    else:
+        track = item.get("uri") or item.get("id")
+        if not track:
+            return None
+    theme = params["theme"]
+    progress = None
+    if get_theme(theme).progress:
+        is_playing = item.get("is_playing", True) if item else None
+        progress = (progress_ms, duration_ms, is_playing)
+    return fingerprint(
+        TEMPLATE_VERSION,
+        track,
+        is_now_playing,
+        progress,
+        theme,
+        params["bar_color"],
+        params["background_color"],
+        params["mode"],
+        params["cover_image"],
+        params["is_bar_color_from_cover"],
+        params["show_offline"],
+        params["interchange"],
     )
-    show_offline = request.args.get("show_offline", default="false") == "true"
-    interchange = request.args.get("interchange", default="false") == "true"
-    mode = request.args.get("mode", default="light")
 
-    # Handle invalid request
-    if not uid:
-        return Response("not ok")
 
-    try:
-        item, is_now_playing, progress_ms, duration_ms = get_song_info(
-            uid, show_offline
-        )
-    except spotify.InvalidTokenError as e:
+def is_complete(params, cover_url, img):
+    # A card missing its cover is rendered again until the download succeeds
+    return bool(img or not (params["cover_image"] and cover_url))
 
-        # Handle invalid token
-        return Response(
-            "Error: Invalid Spotify access_token or refresh_token. Possibly the token revoked. Please re-login at https://github.com/kittinan/spotify-github-profile"
-        )
 
-    if (show_offline and not is_now_playing) or (item is None):
-        if interchange:
+def cache_card(key, svg, params, cover_url, img):
+    if key and is_complete(params, cover_url, img):
+        RENDER_CACHE.put(key, svg)
+
+
+def card_max_age(params, item, is_now_playing, progress_ms, duration_ms):
+    """Seconds the card stays accurate unless playback changes.
+
+    A playing track is shown until it ends; paused tracks may resume at any
+    moment, and offline and recently played cards change less often.
+    """
+    if not (item and is_now_playing):
+        return CARD_IDLE_MAX_AGE
+    if not item.get("is_playing", True) or not duration_ms or progress_ms is None:
+        return CARD_MAX_AGE
+    remaining = (duration_ms - progress_ms) // 1000
+    if get_theme(params["theme"]).progress:
+        limit = min(remaining - CARD_PROGRESS_MARGIN, CARD_PROGRESS_MAX_AGE)
+    else:
+        limit = min(remaining, CARD_NOW_PLAYING_MAX_AGE)
+    return max(CARD_MAX_AGE, limit)
+
+
+def card_cache_control(params, item, is_now_playing, progress_ms, duration_ms):
+    max_age = card_max_age(params, item, is_now_playing, progress_ms, duration_ms)
+    if get_theme(params["theme"]).progress:
+        # A stale progress card would show a finished or lagging bar
+        return cache_control(max_age, stale_while_revalidate=0)
+    return cache_control(max_age)
+
+
+def card_result(key, svg, complete, policy, if_none_match, accept_encoding):
+    """Status, headers and body answering a request for a rendered card.
+
+    Cards without a key or missing their cover are tagged by their content,
+    so a client holding one does not keep it once the full card exists.
+    """
+    if not (key and complete):
+        key = fingerprint(svg)
+        result = not_modified(key, policy, if_none_match)
+        if result is not None:
+            return result
+    body, encoding = encode_card(key, svg, accept_encoding)
+    return svg_result(key, body, policy, encoding)
+
+
+def encode_card(key, svg, accept_encoding):
+    """Response body and Content-Encoding of ``svg`` for ``accept_encoding``.
+
+    Compressed bodies of cached cards are stored next to them.
+    """
+    body = svg.encode()
+    encoding = choose_encoding(body, accept_encoding)
+    if encoding is None:
+        return body, None
+    compressed = RENDER_CACHE.get_body(key, encoding) if key else None
+    if compressed is None:
+        compressed = compress(body, encoding)
+        if key:
+            RENDER_CACHE.put_body(key, encoding, compressed)
+    return compressed, encoding
+
+
+def render_card(params, item, is_now_playing, progress_ms, duration_ms, img=None):
+    """Render the card SVG from already fetched data (no network I/O)."""
+    theme = params["theme"]
+    bar_color = params["bar_color"]
+    cover_image = params["cover_image"]
+
+    if is_offline(params, item, is_now_playing):
+        if params["interchange"]:
             artist_name = "Currently not playing on Spotify"
             song_name = "Offline"
         else:
             artist_name = "Offline"
             song_name = "Currently not playing on Spotify"
-        img_b64 = ""
-        cover_image = False
-        svg = make_svg(
+        return make_svg(
             artist_name,
             song_name,
-            img_b64,
+            "",
             is_now_playing,
-            cover_image,
+            False,
             theme,
             bar_color,
-            show_offline,
-            background_color,
-            mode,
+            params["show_offline"],
+            params["background_color"],
+            params["mode"],
             progress_ms,
             duration_ms,
         )
-        resp = Response(svg, mimetype="image/svg+xml")
-        resp.headers["Cache-Control"] = "s-maxage=1"
-        return resp
 
     currently_playing_type = item.get("currently_playing_type", "track")
 
-    if is_redirect:
-        return redirect(item["uri"], code=302)
-
-    img = None
     img_b64 = ""
-    if cover_image:
-
-        if currently_playing_type == "track":
-            img = load_image(item["album"]["images"][1]["url"])
-        elif currently_playing_type == "episode":
-            img = load_image(item["images"][1]["url"])
-
+    if cover_image and img:
         img_b64 = to_img_b64(img)
 
     # Extract cover image color
-    if is_bar_color_from_cover and img:
+    if params["is_bar_color_from_cover"] and img:
 
         is_skip_dark = False
         if theme in ["default"]:
             is_skip_dark = True
 
-        pil_img = Image.open(io.BytesIO(img))
-        colors = colorgram.extract(pil_img, 5)
+        colors = extract_palette(img, 5)
 
-        for color in colors:
+        for rgb in colors:
 
-            rgb = color.rgb
-
-            light_or_dark = isLightOrDark([rgb.r, rgb.g, rgb.b], threshold=80)
+            light_or_dark = isLightOrDark(list(rgb), threshold=80)
 
             if light_or_dark == "dark" and is_skip_dark:
                 # Skip to use bar in dark color
@@ -429,12 +610,12 @@ def catch_all(path):
         artist_name = item["show"]["publisher"]
         song_name = item["name"]
 
-    if interchange:
+    if params["interchange"]:
         x = artist_name
         artist_name = song_name
         song_name = x
 
-    svg = make_svg(
+    return make_svg(
         artist_name,
         song_name,
         img_b64,
@@ -442,19 +623,62 @@ def catch_all(path):
         cover_image,
         theme,
         bar_color,
-        show_offline,
-        background_color,
-        mode,
+        params["show_offline"],
+        params["background_color"],
+        params["mode"],
         progress_ms,
         duration_ms,
+        item.get("is_playing", True),
     )
 
-    resp = Response(svg, mimetype="image/svg+xml")
-    resp.headers["Cache-Control"] = "s-maxage=1"
 
-    print("cache size:", getsizeof(CACHE_TOKEN_INFO))
+@app.route("/", defaults={"path": ""})
+@app.route("/<path:path>")
+def catch_all(path):
+    params = parse_card_params(request.args)
+
+    # Handle invalid request
+    if not params["uid"]:
+        return Response("not ok")
+
+    try:
+        item, is_now_playing, progress_ms, duration_ms = get_song_info(
+            params["uid"], params["show_offline"]
+        )
+    except spotify.InvalidTokenError as e:
+
+        # Handle invalid token
+        return Response(INVALID_TOKEN_MESSAGE)
+
+    offline = is_offline(params, item, is_now_playing)
+    if not offline and params["is_redirect"]:
+        return redirect(item["uri"], code=302)
+
+    if get_theme(params["theme"]).progress:
+        progress_ms = bucket_progress(progress_ms)
+    key = card_key(params, item, is_now_playing, progress_ms, duration_ms)
+    policy = card_cache_control(params, item, is_now_playing, progress_ms, duration_ms)
+    if_none_match = request.headers.get("If-None-Match")
+    result = not_modified(key, policy, if_none_match) if key else None
+    if result is None:
+        svg = RENDER_CACHE.get(key) if key else None
+        complete = svg is not None
+        if svg is None:
+            img = None
+            cover_url = None if offline else get_cover_url(item)
+            if params["cover_image"] and cover_url:
+                img = load_image(cover_url, size=cover_size(params["theme"]))
+
+            svg = render_card(
+                params, item, is_now_playing, progress_ms, duration_ms, img
+            )
+            cache_card(key, svg, params, cover_url, img)
+            complete = is_complete(params, cover_url, img)
+        accept_encoding = request.headers.get("Accept-Encoding")
+        result = card_result(key, svg, complete, policy, if_none_match, accept_encoding)
 
-    return resp
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
 
 
 if __name__ == "__main__":
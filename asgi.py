@@ -0,0 +1,326 @@
+"""ASGI entry point serving the card endpoints with an asyncio pipeline.
+
+Run it from the repository root, e.g.::
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5003 --workers 4
+
+Spotify and cover requests go through util.spotify_async and the async
+helpers of util.images, so a single worker keeps many card requests waiting
+on upstream I/O at once. Token lookups hit the cache inline and fall back to
+a thread only for Firestore. Parsing and rendering reuse the helpers of the
+Flask endpoints, so both servers produce the same cards.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+from api import recently_played, view
+from util import spotify, spotify_async
+from util.http_cache import Result, not_modified
+from util.http_client import close_async_client
+from util.images import fetch_data_uri_async, load_image_async
+from util.palette import cached_palette
+from util.play_history import PLAY_HISTORY
+from util.render_cache import bucket_progress
+from util.themes import get_theme
+from util.token_store import get_token_store
+
+logger = logging.getLogger("spotify-profile")
+
+# Delta fetches of play history in flight, shared by concurrent requests
+_history_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str], "asyncio.Task"] = {}
+
+
+async def _access_token(store, uid: str) -> Optional[str]:
+    token = store.cached_access_token(uid)
+    if token is None:
+        token = await asyncio.to_thread(store.get_access_token, uid)
+    return token
+
+
+def _discard(task: "asyncio.Task") -> None:
+    task.cancel()
+    # Retrieve the outcome so a failed, unused task is not logged
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def _update_history(uid: str, fetch) -> None:
+    kwargs = PLAY_HISTORY.fetch_kwargs(uid)
+    PLAY_HISTORY.update(uid, await fetch(**kwargs), kwargs.get("after"))
+
+
+def _history_done(key, task: "asyncio.Task") -> None:
+    _history_inflight.pop(key, None)
+    # Every waiter may have gone; don't log the outcome as unretrieved
+    task.cancelled() or task.exception()
+
+
+async def _refresh_history(uid: str, fetch) -> List[Dict[str, Any]]:
+    """Async :meth:`PlayHistory.refresh`: one delta fetch per stale uid."""
+    if not PLAY_HISTORY.is_fresh(uid):
+        key = (asyncio.get_running_loop(), uid)
+        task = _history_inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(_update_history(uid, fetch))
+            _history_inflight[key] = task
+            task.add_done_callback(lambda t: _history_done(key, t))
+        try:
+            # A cancelled waiter must not cancel the fetch shared with others
+            await asyncio.shield(task)
+        except spotify.RateLimitError:
+            # Rate limited or over quota: serve the stored history, if any
+            if not PLAY_HISTORY.has(uid):
+                raise
+    return PLAY_HISTORY.items(uid)
+
+
+async def get_recent_plays(uid: str, access_token: str, acquire: bool = True):
+    async def fetch(**kwargs):
+        if acquire:
+            spotify.acquire_quota(uid)
+        return await spotify_async.get_recently_played(access_token, **kwargs)
+
+    items = await _refresh_history(uid, fetch)
+    return {"items": items[: view.RECENT_PLAYS_PICK]}
+
+
+async def get_song_info(uid: str, show_offline: bool):
+    view.mark_active(uid)
+    access_token = await _access_token(get_token_store(), uid)
+
+    # Handle refrest_token revoke or invalid token
+    if access_token is None:
+        raise spotify.InvalidTokenError("Invalid Spotify access_token or refresh_token")
+
+    recent_task = None
+    try:
+        data = view.NOW_PLAYING_CACHE.get(uid)
+        if data is None:
+            if view.should_prefetch_recently_played(uid, show_offline):
+                recent_task = asyncio.ensure_future(
+                    get_recent_plays(uid, access_token, acquire=False)
+                )
+            spotify.acquire_quota(uid)
+            try:
+                data = await spotify_async.get_now_playing(access_token)
+            except spotify.InvalidTokenError:
+                access_token = await asyncio.to_thread(get_token_store().refresh, uid)
+                if access_token is None:
+                    raise
+                data = await spotify_async.get_now_playing(access_token)
+            view.NOW_PLAYING_CACHE.set(uid, data)
+
+        if data:
+            return view.song_info_from_now_playing(data)
+        elif show_offline:
+            return None, False, None, None
+
+        if recent_task is not None:
+            recent_plays = await recent_task
+        else:
+            recent_plays = await get_recent_plays(uid, access_token)
+    except spotify.UNAVAILABLE_ERRORS:
+        return view.degraded_song_info(uid)
+    finally:
+        if recent_task is not None:
+            _discard(recent_task)
+    return view.song_info_from_recently_played(recent_plays)
+
+
+def _in_app(flask_app, render, *args) -> str:
+    # Flask 1.x contexts are thread-local, so never hold one across an await
+    with flask_app.app_context():
+        return render(*args)
+
+
+async def view_card(args, request_headers: Dict[str, str]) -> Result:
+    params = view.parse_card_params(args)
+    text_headers = {"Content-Type": "text/html; charset=utf-8"}
+
+    # Handle invalid request
+    if not params["uid"]:
+        return 200, text_headers, b"not ok"
+
+    try:
+        item, is_now_playing, progress_ms, duration_ms = await get_song_info(
+            params["uid"], params["show_offline"]
+        )
+    except spotify.InvalidTokenError:
+        return 200, text_headers, view.INVALID_TOKEN_MESSAGE.encode()
+
+    offline = view.is_offline(params, item, is_now_playing)
+    if not offline and params["is_redirect"]:
+        return 302, {"Location": item["uri"]}, b""
+
+    if get_theme(params["theme"]).progress:
+        progress_ms = bucket_progress(progress_ms)
+    key = view.card_key(params, item, is_now_playing, progress_ms, duration_ms)
+    policy = view.card_cache_control(
+        params, item, is_now_playing, progress_ms, duration_ms
+    )
+    if_none_match = request_headers.get("if-none-match")
+    if key:
+        result = not_modified(key, policy, if_none_match)
+        if result is not None:
+            return result
+
+    svg = view.RENDER_CACHE.get(key) if key else None
+    complete = svg is not None
+    if svg is None:
+        img = None
+        cover_url = None if offline else view.get_cover_url(item)
+        if params["cover_image"] and cover_url:
+            img = await load_image_async(
+                cover_url, size=view.cover_size(params["theme"])
+            )
+
+        render_args = (params, item, is_now_playing, progress_ms, duration_ms, img)
+        if params["is_bar_color_from_cover"] and img and cached_palette(img) is None:
+            # Palette extraction is CPU bound, keep it off the event loop
+            svg = await asyncio.to_thread(
+                _in_app, view.app, view.render_card, *render_args
+            )
+        else:
+            svg = _in_app(view.app, view.render_card, *render_args)
+        view.cache_card(key, svg, params, cover_url, img)
+        complete = view.is_complete(params, cover_url, img)
+
+    accept_encoding = request_headers.get("accept-encoding")
+    return view.card_result(key, svg, complete, policy, if_none_match, accept_encoding)
+
+
+async def _fetch_recently_played(uid: str, limit: int) -> Dict[str, Any]:
+    store = get_token_store()
+
+    async def fetch(**kwargs):
+        token = await _access_token(store, uid)
+        if token is None:
+            raise RuntimeError("user not found")
+        spotify.acquire_quota(uid)
+        try:
+            return await spotify_async.get_recently_played(token, **kwargs)
+        except spotify.InvalidTokenError:
+            token = await asyncio.to_thread(store.refresh, uid)
+            if token is None:
+                raise
+            return await spotify_async.get_recently_played(token, **kwargs)
+
+    items = await _refresh_history(uid, fetch)
+    return {"items": items[:limit]}
+
+
+async def _cover(url: Optional[str]) -> Optional[str]:
+    return (
+        await fetch_data_uri_async(url, size=recently_played.COVER_SIZE)
+        if url
+        else None
+    )
+
+
+async def _covers(tracks: List[Dict[str, Any]]) -> List[Optional[str]]:
+    tasks = [
+        asyncio.ensure_future(_cover(recently_played._cover_url(t))) for t in tracks
+    ]
+    if not tasks:
+        return []
+    done, pending = await asyncio.wait(
+        tasks, timeout=recently_played.COVER_FETCH_DEADLINE
+    )
+    # Shared downloads are shielded and still fill the cache
+    for task in pending:
+        _discard(task)
+    return [task.result() if task in done else None for task in tasks]
+
+
+async def recently_played_card(args, request_headers: Dict[str, str]) -> Result:
+    rp = recently_played
+    theme, limit, width = rp._parse_params(args)
+    if_none_match = request_headers.get("if-none-match")
+    accept_encoding = request_headers.get("accept-encoding")
+    uid = rp._uid_from_args(args)
+    if not uid:
+        uid = await asyncio.to_thread(rp._default_user_id)
+
+    if not uid:
+        svg = _in_app(rp.app, rp._render_error, "Please provide ?uid=<spotify id>")
+        return rp._result(None, svg, if_none_match, accept_encoding)
+    try:
+        data = await _fetch_recently_played(uid, limit)
+        raw_items = data.get("items", []) if data else []
+        key = rp._recent_key(theme, width, raw_items)
+        result = rp._not_modified(key, if_none_match)
+        if result is not None:
+            return result
+
+        if rp._is_spotify_theme(theme):
+            tracks = rp._tracks(raw_items)[:limit]
+            covers = await _covers(tracks)
+            svg = _in_app(rp.app, rp._render_spotify, tracks, covers, width)
+            if not rp._is_complete(tracks, covers):
+                key = None
+        else:
+            svg = _in_app(rp.app, rp._render_recent, raw_items)
+        return rp._result(key, svg, if_none_match, accept_encoding)
+    except Exception as exc:  # noqa: BLE001
+        svg = _in_app(rp.app, rp._render_error, rp._error_message(exc))
+        return rp._result(None, svg, if_none_match, accept_encoding)
+
+
+async def handle(path: str, args, request_headers: Dict[str, str]) -> Result:
+    if path in ("/api/recently_played", "/api/recentlyplayed"):
+        return 301, {"Location": "/api/recently-played"}, b""
+    if path == "/api/recently-played":
+        return await recently_played_card(args, request_headers)
+    return await view_card(args, request_headers)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_client()
+            store = get_token_store()
+            if store.writer:
+                await asyncio.to_thread(store.writer.flush)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    query = scope.get("query_string", b"").decode("latin-1")
+    args = MultiDict(parse_qsl(query, keep_blank_values=True))
+    request_headers = {
+        k.decode("latin-1").lower(): v.decode("latin-1")
+        for k, v in scope.get("headers", [])
+    }
+    try:
+        status, headers, body = await handle(scope["path"], args, request_headers)
+    except Exception:  # noqa: BLE001
+        logger.exception("request failed")
+        status, headers = 500, {"Content-Type": "text/plain; charset=utf-8"}
+        body = b"Internal Server Error"
+
+    headers["Content-Length"] = str(len(body))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (k.lower().encode("latin-1"), v.encode("latin-1"))
+                for k, v in headers.items()
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,69 @@
+"""Compare the colorgram and NumPy palette extractors on real cover art.
+
+Usage (from the repository root)::
+
+    python scripts/bench_palette.py [image files or URLs ...]
+
+Without arguments the covers embedded in the example cards under img/ are
+used. Each extractor runs on the full cover and on the downsampled copy
+the card endpoint actually quantizes (PALETTE_SAMPLE_SIZE).
+"""
+
+import base64
+import glob
+import io
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from util.palette import PALETTE_SAMPLE_SIZE, colorgram_palette, numpy_palette
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "img", "*.svg")
+
+
+def example_covers():
+    for path in sorted(glob.glob(EXAMPLES)):
+        with open(path, encoding="utf-8") as f:
+            for data in re.findall(r"base64, ?(/9j/[A-Za-z0-9+/=]+)", f.read()):
+                yield os.path.basename(path), base64.b64decode(data)
+
+
+def load(arg):
+    if arg.startswith("http"):
+        from util.images import load_image
+
+        return arg, load_image(arg)
+    with open(arg, "rb") as f:
+        return os.path.basename(arg), f.read()
+
+
+def bench(fn, img, number):
+    return min(timeit.repeat(lambda: fn(img, 5), number=number, repeat=3)) / number
+
+
+def main(args):
+    covers = [load(arg) for arg in args] or list(example_covers())
+    print(f"{'cover':<20} {'size':>9} {'colorgram':>12} {'numpy':>10} {'speedup':>8}")
+    for name, content in covers:
+        full = Image.open(io.BytesIO(content)).convert("RGB")
+        small = full.copy()
+        small.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+        for img in (full, small):
+            assert colorgram_palette(img, 5) == numpy_palette(img, 5)
+            number = 3 if img is full else 50
+            slow = bench(colorgram_palette, img, number)
+            fast = bench(numpy_palette, img, number)
+            size = "x".join(map(str, img.size))
+            print(
+                f"{name:<20} {size:>9} {slow * 1000:>10.2f}ms "
+                f"{fast * 1000:>8.2f}ms {slow / fast:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
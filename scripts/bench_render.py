@@ -0,0 +1,46 @@
+"""Compare a full Jinja render of the now-playing card with its skeleton.
+
+Usage (from the repository root)::
+
+    python scripts/bench_render.py
+
+For every registered theme the card is rendered the way it was before the
+theme registry (bar markup built and template rendered per request) and
+through ``make_svg``, which fills the cached skeleton.
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from api import view
+from test_themes import _jinja_render
+from util.themes import THEMES
+
+# A 300px JPEG cover is about 20 KB, i.e. 27 KB of base64
+IMG = "A" * 27000
+
+
+def bench(fn, number=500):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def main():
+    args = ("Artist", "Song", IMG, True, True)
+    print(f"{'theme':<12} {'jinja':>10} {'skeleton':>10} {'speedup':>8}")
+    with view.app.test_request_context():
+        for theme in THEMES:
+            card = args + (theme, "53b14f", False, "121212", "light")
+            slow = bench(lambda: _jinja_render(*card))
+            fast = bench(lambda: view.make_svg(*card, 61000, 200000))
+            print(
+                f"{theme:<12} {slow * 1e6:>8.1f}us {fast * 1e6:>8.1f}us "
+                f"{slow / fast:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util.token_store import get_token_store
+
+
+class FakeDoc:
+    def __init__(self, data, uid):
+        self._data = data
+        self.id = uid
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.uid, data))
+
+    def commit(self):
+        if self.db.fail:
+            raise RuntimeError("firestore unavailable")
+        self.db.commits += 1
+        for uid, data in self.writes:
+            self.db.docs.setdefault(uid, {}).update(data)
+
+
+class FakeDB:
+    """In-memory stand-in for the Firestore users collection."""
+
+    def __init__(self, docs, direct_writes=True):
+        self.docs = docs
+        # False makes document writes fail, so they must go through a batch
+        self.direct_writes = direct_writes
+        self.reads = 0
+        self.commits = 0
+        self.fail = False
+
+    def collection(self, name):
+        assert name == "users"
+        return self
+
+    def document(self, uid):
+        db = self
+
+        class Ref:
+            def get(self):
+                db.reads += 1
+                return FakeDoc(db.docs.get(uid), uid)
+
+            def set(self, info, merge=False):
+                if not db.direct_writes:
+                    raise AssertionError("token updates must go through the queue")
+                if merge:
+                    db.docs.setdefault(uid, {}).update(info)
+                else:
+                    db.docs[uid] = dict(info)
+
+            def delete(self):
+                db.docs.pop(uid, None)
+
+        ref = Ref()
+        ref.uid = uid
+        return ref
+
+    def batch(self):
+        return FakeBatch(self)
+
+
+def base_db():
+    """A database holding user u1 with a valid access token ``t``."""
+    return FakeDB(
+        {
+            "u1": {
+                "access_token": "t",
+                "refresh_token": "r",
+                "expired_ts": int(time.time()) + 600,
+            }
+        }
+    )
+
+
+def track(name="Song", artist="Artist"):
+    return {
+        "name": name,
+        "uri": "spotify:track:1",
+        "duration_ms": 200000,
+        "artists": [{"name": artist}],
+        "album": {"images": [{"url": "https://img/640"}, {"url": "https://img/300"}]},
+    }
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """:func:`base_db`, used by the shared token store and the endpoints."""
+    db = base_db()
+    get_token_store().cache.clear()
+    monkeypatch.setattr("util.token_store.get_firestore_db", lambda: db)
+    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    return db
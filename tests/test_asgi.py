@@ -0,0 +1,216 @@
+import asyncio
+import gzip
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api import recently_played, view
+from asgi import app, get_recent_plays
+from conftest import track
+from util import spotify
+from util.play_history import PLAY_HISTORY
+
+TINY_PNG = b"\x89PNG\r\n\x1a\n"
+
+
+def call(path, query="", headers=()):
+    scope = {
+        "type": "http",
+        "path": path,
+        "query_string": query.encode(),
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+    }
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start, body = sent
+    return start["status"], dict(start["headers"]), body["body"]
+
+
+def _async(value):
+    async def fake(*args, **kwargs):
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    return fake
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch, fake_db):
+    view.NOW_PLAYING_CACHE.clear()
+    view.RENDER_CACHE.clear()
+    PLAY_HISTORY.clear()
+    monkeypatch.setattr("asgi.load_image_async", _async(TINY_PNG))
+
+
+def test_now_playing_card(monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify_async.get_now_playing",
+        _async({"item": track("Song"), "currently_playing_type": "track"}),
+    )
+    status, headers, body = call("/api/view", "uid=u1")
+    assert status == 200
+    assert headers[b"content-type"] == b"image/svg+xml; charset=utf-8"
+    assert b"Now playing" in body and b"Song" in body
+
+
+def test_recently_played_is_prefetched_concurrently(monkeypatch):
+    monkeypatch.setattr("api.view.PREFETCH_RECENTLY_PLAYED", True)
+    started = asyncio.Event()
+
+    async def now_playing(token):
+        await asyncio.wait_for(started.wait(), 2)
+        return {}
+
+    async def get_recently_played(token, **k):
+        started.set()
+        return {"items": [{"track": track("Old")}]}
+
+    monkeypatch.setattr("util.spotify_async.get_now_playing", now_playing)
+    monkeypatch.setattr("util.spotify_async.get_recently_played", get_recently_played)
+    body = call("/api/view", "uid=u1&cover_image=false")[2]
+    assert b"Recently played" in body and b"Old" in body
+
+
+def test_concurrent_requests_share_one_history_fetch(monkeypatch):
+    calls = []
+
+    async def fake_get(token, **kwargs):
+        calls.append(kwargs)
+        await asyncio.sleep(0.01)
+        return {"items": [{"track": track("S"), "played_at": "2024-01-04T23:59:00Z"}]}
+
+    monkeypatch.setattr("util.spotify_async.get_recently_played", fake_get)
+
+    async def main():
+        return await asyncio.gather(*(get_recent_plays("u1", "t") for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(r["items"][0]["track"]["name"] == "S" for r in results)
+
+
+def test_missing_uid_and_invalid_token():
+    assert call("/api/view")[2] == b"not ok"
+    assert b"Invalid Spotify access_token" in call("/api/view", "uid=nobody")[2]
+
+
+def test_recently_played_matches_flask_output(monkeypatch):
+    items = {
+        "items": [
+            {"track": track(f"T{i}"), "played_at": "2024-01-04T23:59:00Z"}
+            for i in range(3)
+        ]
+    }
+    monkeypatch.setattr("util.spotify_async.get_recently_played", _async(items))
+    monkeypatch.setattr("util.spotify.get_recently_played", lambda *a, **k: items)
+    status, headers, body = call("/api/recently-played", "uid=u1&limit=3")
+    assert status == 200
+    flask_resp = recently_played.app.test_client().get(
+        "/api/recently-played?uid=u1&limit=3"
+    )
+    assert body == flask_resp.data
+
+    etag = headers[b"etag"].decode()
+    status, _, body = call(
+        "/api/recently-played", "uid=u1&limit=3", [("If-None-Match", etag)]
+    )
+    assert status == 304 and body == b""
+
+
+def test_recently_played_refreshes_invalid_token(monkeypatch, fake_db):
+    calls = []
+
+    async def fake_get(token, limit=5):
+        calls.append(token)
+        if len(calls) == 1:
+            raise spotify.InvalidTokenError("bad")
+        return {"items": [{"track": track("S")}]}
+
+    monkeypatch.setattr("util.spotify_async.get_recently_played", fake_get)
+    monkeypatch.setattr(
+        "util.spotify.refresh_token",
+        lambda r: {"access_token": "new", "expires_in": 3600},
+    )
+    status, _, body = call("/api/recently-played", "uid=u1")
+    assert status == 200
+    assert calls == ["t", "new"]
+    assert fake_db.docs["u1"]["access_token"] == "new"
+
+
+def test_now_playing_refreshes_invalid_token(monkeypatch):
+    calls = []
+
+    async def now_playing(token):
+        calls.append(token)
+        if token == "t":
+            raise spotify.InvalidTokenError("bad")
+        return {"item": track("Fresh"), "currently_playing_type": "track"}
+
+    monkeypatch.setattr("util.spotify_async.get_now_playing", now_playing)
+    monkeypatch.setattr("util.spotify.refresh_token", lambda r: {"access_token": "new"})
+    status, _, body = call("/api/view", "uid=u1")
+    assert status == 200 and b"Fresh" in body
+    assert calls == ["t", "new"]
+
+
+def test_timeout_serves_last_snapshot(monkeypatch):
+    view.NOW_PLAYING_CACHE.set(
+        "u1", {"item": track("Cached"), "currently_playing_type": "track"}
+    )
+    monkeypatch.setattr(view.NOW_PLAYING_CACHE, "ttl", 1e-9)
+    monkeypatch.setattr(
+        "util.spotify_async.get_now_playing",
+        _async(spotify.SpotifyTimeoutError("timeout")),
+    )
+    status, _, body = call("/api/view", "uid=u1")
+    assert status == 200 and b"Cached" in body
+
+
+def test_alias_redirect():
+    status, headers, _ = call("/api/recentlyplayed")
+    assert status == 301
+    assert headers[b"location"] == b"/api/recently-played"
+
+
+def test_recently_played_covers_miss_deadline(monkeypatch):
+    items = {
+        "items": [
+            {"track": dict(track(f"T{i}"), album={"images": [{"url": f"u{i}"}]})}
+            for i in range(3)
+        ]
+    }
+
+    async def fetch(url, **k):
+        await asyncio.sleep(5 if url == "u2" else 0.1)
+        return f"data:image/png;base64,{url}"
+
+    monkeypatch.setattr("util.spotify_async.get_recently_played", _async(items))
+    monkeypatch.setattr("asgi.fetch_data_uri_async", fetch)
+    monkeypatch.setattr("api.recently_played.COVER_FETCH_DEADLINE", 0.5)
+    start = time.monotonic()
+    body = call("/api/recently-played", "uid=u1&theme=spotify")[2]
+    assert time.monotonic() - start < 2
+    assert b"base64,u0" in body and b"base64,u1" in body
+    assert b"base64,u2" not in body and body.count(b'fill="#2B2F33"') == 1
+
+
+def test_cards_are_compressed(monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify_async.get_now_playing",
+        _async({"item": track("Song"), "currently_playing_type": "track"}),
+    )
+    status, headers, body = call("/api/view", "uid=u1", [("Accept-Encoding", "gzip")])
+    assert headers[b"content-encoding"] == b"gzip"
+    assert b"Now playing" in gzip.decompress(body)
@@ -0,0 +1,113 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import circuit_breaker, spotify
+from util.circuit_breaker import CircuitBreaker, parse_retry_after
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, payload=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = payload or {}
+
+    def json(self):
+        return self._payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(self.status_code)
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return self.responses.pop(0)
+
+
+def _clock(monkeypatch, start=1000.0):
+    now = [start]
+    monkeypatch.setattr(circuit_breaker.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def session(monkeypatch):
+    spotify.BREAKER.reset()
+    fake = FakeSession([])
+    monkeypatch.setattr("util.spotify.get_session", lambda: fake)
+    yield fake
+    spotify.BREAKER.reset()
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+
+
+def test_retry_after_blocks_until_elapsed(monkeypatch):
+    now = _clock(monkeypatch)
+    breaker = CircuitBreaker(threshold=5)
+    breaker.record_rate_limit(10)
+    assert breaker.wait_time() == 10
+    now[0] += 10
+    assert breaker.wait_time() == 0
+
+
+def test_opens_after_threshold_and_probes_once(monkeypatch):
+    now = _clock(monkeypatch)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.wait_time() == 0
+    breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.wait_time() == 30
+
+    now[0] += 30
+    assert breaker.wait_time() == 0  # the probe
+    assert breaker.wait_time() == 30  # everyone else still waits
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.wait_time() == 0
+
+
+def test_now_playing_429_honours_retry_after(session):
+    session.responses.append(FakeResponse(429, {"Retry-After": "20"}))
+    with pytest.raises(spotify.RateLimitError) as exc:
+        spotify.get_now_playing("t")
+    assert exc.value.retry_after == 20
+
+    # Further calls fail fast without touching the network
+    with pytest.raises(spotify.CircuitOpenError):
+        spotify.get_recently_played("t")
+    assert session.calls == 1
+
+
+def test_server_errors_open_the_breaker(session, monkeypatch):
+    monkeypatch.setattr(spotify.BREAKER, "threshold", 2)
+    session.responses.extend([FakeResponse(503), FakeResponse(502)])
+    with pytest.raises(spotify.SpotifyServerError):
+        spotify.get_recently_played("t")
+    assert session.calls == 2
+    assert spotify.BREAKER.is_open
+    with pytest.raises(spotify.CircuitOpenError):
+        spotify.get_now_playing("t")
+
+
+def test_success_resets_failures(session):
+    session.responses.extend(
+        [FakeResponse(500), FakeResponse(200, payload={"items": []})]
+    )
+    assert spotify.get_recently_played("t") == {"items": []}
+    assert spotify.BREAKER.wait_time() == 0
+    assert not spotify.BREAKER.is_open
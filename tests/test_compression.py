@@ -0,0 +1,50 @@
+import gzip
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import compression
+from util.compression import choose_encoding, compress, negotiate
+
+
+class FakeBrotli:
+    @staticmethod
+    def compress(body, quality):
+        return b"br:" + body
+
+
+def test_negotiate(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate("gzip, deflate, br") == "gzip"
+    assert negotiate("deflate") is None
+    assert negotiate("gzip;q=0, *;q=0.5") is None
+    assert negotiate("*") == "gzip"
+    assert negotiate("") is None
+    assert negotiate(None) is None
+
+    monkeypatch.setattr(compression, "brotli", FakeBrotli)
+    assert negotiate("gzip, deflate, br") == "br"
+    assert negotiate("br;q=0, gzip") == "gzip"
+
+
+def test_compress_round_trip(monkeypatch):
+    body = b"<svg>" + b"a" * 1000 + b"</svg>"
+    assert choose_encoding(body[:100], "gzip") is None
+    assert choose_encoding(body, "gzip") == "gzip"
+    packed = compress(body, "gzip")
+    assert gzip.decompress(packed) == body
+    # Deterministic, so caches and ETags can rely on it
+    assert compress(body, "gzip") == packed
+    assert compress(body, None) is body
+
+
+def test_brotli_round_trip():
+    brotli = pytest.importorskip("brotli")
+    body = b"<svg>" + b"a" * 1000 + b"</svg>"
+    assert choose_encoding(body, "gzip, deflate, br") == "br"
+    packed = compress(body, "br")
+    assert brotli.decompress(packed) == body
+    assert len(packed) < len(compress(body, "gzip"))
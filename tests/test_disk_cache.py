@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import images
+from util.disk_cache import DiskImageCache
+
+
+def test_round_trip_and_missing(tmp_path):
+    cache = DiskImageCache(str(tmp_path))
+    assert cache.get("https://img/1") is None
+    cache.put("https://img/1", b"\x89PNG\n\x00", "image/png")
+    assert cache.get("https://img/1") == (b"\x89PNG\n\x00", "image/png")
+    # Another worker opening the same directory sees the file
+    assert DiskImageCache(str(tmp_path)).get("https://img/1")[0] == b"\x89PNG\n\x00"
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskImageCache(str(tmp_path))
+    for i in range(3):
+        cache.put(f"u{i}", b"x" * 30, "image/jpeg")
+        os.utime(cache._file(f"u{i}"), (i, i))
+    cache.get("u0")  # now the most recently used
+
+    # Each file is 41 bytes: only two fit under 90% of 100
+    cache.max_bytes = 100
+    cache.evict()
+    assert cache.get("u1") is None
+    assert cache.get("u0") and cache.get("u2")
+
+
+def test_load_image_reads_disk_before_network(tmp_path, monkeypatch):
+    disk = DiskImageCache(str(tmp_path))
+    disk.put("https://img/1", b"png", "image/png")
+    monkeypatch.setattr(images, "DISK_CACHE", disk)
+    monkeypatch.setattr(images, "get_session", lambda: None)
+    images.IMAGE_CACHE.clear()
+    try:
+        assert images.fetch_data_uri("https://img/1") == "data:image/png;base64,cG5n"
+        assert images.IMAGE_CACHE.get("https://img/1") == (b"png", "image/png")
+    finally:
+        images.IMAGE_CACHE.clear()
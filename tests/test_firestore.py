@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import firestore
+
+
+def test_client_is_created_once_and_reset(monkeypatch):
+    created = []
+
+    def fake_create():
+        created.append(object())
+        return created[-1]
+
+    monkeypatch.setattr("util.firestore._create_client", fake_create)
+    monkeypatch.setattr("util.firestore._db", None)
+    monkeypatch.setattr(
+        "firebase_admin.get_app", lambda: (_ for _ in ()).throw(ValueError)
+    )
+
+    assert created == []
+    firestore.warmup()
+    assert firestore.get_firestore_db() is created[0]
+    assert len(created) == 1
+
+    firestore.reset()
+    assert firestore.get_firestore_db() is created[1]
@@ -0,0 +1,59 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util.http_cache import (
+    cache_control,
+    etag,
+    is_not_modified,
+    not_modified,
+    svg_result,
+    template_version,
+)
+
+
+def test_is_not_modified():
+    tag = etag("abc")
+    assert tag == 'W/"abc"'
+    assert is_not_modified('W/"abc"', tag)
+    assert is_not_modified('"abc"', tag)
+    assert is_not_modified('"x", W/"abc"', tag)
+    assert is_not_modified("*", tag)
+    assert not is_not_modified('"abcd"', tag)
+    assert not is_not_modified(None, tag)
+
+
+def test_results():
+    policy = cache_control(60, stale_while_revalidate=30)
+    assert policy == "public, max-age=60, stale-while-revalidate=30"
+    assert cache_control(1, stale_while_revalidate=0) == "public, max-age=1"
+
+    assert not_modified("abc", policy, '"other"') is None
+    status, headers, body = not_modified("abc", policy, 'W/"abc"')
+    assert (status, body) == (304, b"")
+    assert "Content-Encoding" not in headers
+
+    status, headers, body = svg_result("abc", b"gz", policy, "gzip")
+    assert status == 200 and body == b"gz"
+    assert headers["ETag"] == 'W/"abc"'
+    assert headers["Cache-Control"] == policy
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Vary"] == "Accept-Encoding"
+
+
+def test_template_version_follows_content(tmp_path):
+    (tmp_path / "a.j2").write_text("one")
+    first = template_version(str(tmp_path))
+    assert template_version(str(tmp_path)) == first
+    (tmp_path / "a.j2").write_text("two")
+    assert template_version(str(tmp_path)) != first
+
+
+def test_template_version_follows_render_code_and_settings(tmp_path, monkeypatch):
+    (tmp_path / "a.j2").write_text("one")
+    first = template_version(str(tmp_path), 80, "numpy")
+    assert template_version(str(tmp_path), 80, "numpy") == first
+    assert template_version(str(tmp_path), 60, "numpy") != first
+    monkeypatch.setattr("util.http_cache.RENDER_VERSION", 2)
+    assert template_version(str(tmp_path), 80, "numpy") != first
@@ -0,0 +1,39 @@
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import http_client
+
+
+def test_session_is_shared_and_recreated_after_fork(monkeypatch):
+    first = http_client.get_session()
+    assert http_client.get_session() is first
+    adapter = first.get_adapter("https://api.spotify.com")
+    assert adapter._pool_maxsize == http_client.HTTP_POOL_SIZE
+
+    monkeypatch.setattr("util.http_client._session_pid", -1)
+    assert http_client.get_session() is not first
+
+
+def test_settings_are_read_from_dotenv(tmp_path):
+    root = os.path.join(os.path.dirname(__file__), "..")
+    shutil.copytree(
+        os.path.join(root, "util"),
+        tmp_path / "util",
+        ignore=shutil.ignore_patterns("__pycache__"),
+    )
+    (tmp_path / ".env").write_text("HTTP_POOL_SIZE=3\n")
+    env = {k: v for k, v in os.environ.items() if k != "HTTP_POOL_SIZE"}
+    code = "from util import http_client; print(http_client.HTTP_POOL_SIZE)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.strip() == "3"
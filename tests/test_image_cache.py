@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+
+from util import image_cache, images
+from util.image_cache import ImageCache
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"img"):
+        self.status_code = status_code
+        self.content = content
+        self.headers = {"Content-Type": "image/png"}
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    images.IMAGE_CACHE.clear()
+    yield
+    images.IMAGE_CACHE.clear()
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ImageCache(max_bytes=10, ttl=60)
+    cache.put("a", b"aaaa", "image/png")
+    cache.put("b", b"bbbb", "image/png")
+    assert cache.get("a")
+    cache.put("c", b"cccc", "image/png")
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.size == 8
+
+    cache.put("huge", b"x" * 11, "image/png")
+    assert cache.get("huge") is None
+    assert cache.size == 8
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(image_cache.time, "time", lambda: now[0])
+    cache = ImageCache(max_bytes=100, ttl=60)
+    cache.put("a", b"aaaa", "image/png")
+    now[0] += 60
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_failures_are_not_cached(monkeypatch):
+    responses = [FakeResponse(404), FakeResponse(200, b"png")]
+
+    class Session:
+        def get(self, url, **kwargs):
+            return responses.pop(0)
+
+    monkeypatch.setattr(images, "get_session", lambda: Session())
+    assert images.load_image("https://img/1") == b""
+    assert images.fetch_data_uri("https://img/1") == "data:image/png;base64,cG5n"
+    assert images.load_image("https://img/1") == b"png"
+    assert responses == []
+
+
+def test_concurrent_misses_download_once(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    class Session:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            release.wait(2)
+            return FakeResponse(200, b"png")
+
+    monkeypatch.setattr(images, "get_session", lambda: Session())
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(images.load_image("u")))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    while not calls:
+        pass
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == [b"png"] * 4
+    assert calls == ["u"]
+
+
+def test_async_misses_are_coalesced(monkeypatch):
+    calls = []
+
+    class Client:
+        async def get(self, url):
+            calls.append(url)
+            await asyncio.sleep(0.01)
+            return FakeResponse(200, b"png")
+
+    monkeypatch.setattr(images, "get_async_client", lambda: Client())
+
+    async def main():
+        return await asyncio.gather(
+            *(images.load_image_async("u") for _ in range(3)),
+            images.fetch_data_uri_async("u"),
+        )
+
+    results = asyncio.run(main())
+    assert results[:3] == [b"png"] * 3
+    assert results[3] == "data:image/png;base64,cG5n"
+    assert calls == ["u"]
@@ -0,0 +1,54 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import jinja2
+import pytest
+
+from util.minify import MinifyingLoader, minify_template
+
+TEMPLATES = os.path.join(os.path.dirname(__file__), "..", "api", "templates")
+
+
+def _squash(text):
+    return re.sub(r"\s+", "", text).replace(";}", "}")
+
+
+def test_minify_keeps_jinja_tags_apart():
+    source = "<style>\n  .a {\n    {% if x %}\n    color: red;\n    {% endif %}\n  }\n</style>"
+    minified = minify_template(source)
+    assert "{{%" not in minified
+    env = jinja2.Environment()
+    rendered = env.from_string(minified).render(x=True)
+    assert _squash(rendered) == "<style>.a{color:red}</style>"
+
+
+@pytest.mark.parametrize(
+    "name", [n for n in os.listdir(TEMPLATES) if n.startswith("spotify.")]
+)
+def test_minified_templates_render_the_same_markup(name):
+    plain = jinja2.Environment(loader=jinja2.FileSystemLoader(TEMPLATES))
+    minified = jinja2.Environment(
+        loader=MinifyingLoader(jinja2.FileSystemLoader(TEMPLATES))
+    )
+    context = {
+        "height": 445,
+        "title_text": "Now playing",
+        "artist_name": "Artist",
+        "song_name": "Song",
+        "img": "aW1n",
+        "cover_image": True,
+        "bar_color": "53b14f",
+        "background_color": "121212",
+        "content_bar": "<div class='bar'></div>",
+        "css_bar": ".bar:nth-child(1n+1){animation-duration:400ms}",
+        "progress_data": {"progress_percentage": 10, "current_time": "0:10"},
+    }
+    for mode in ("light", "dark"):
+        expected = plain.get_template(name).render(mode=mode, **context)
+        rendered = minified.get_template(name).render(mode=mode, **context)
+        assert len(rendered) < len(expected)
+        # Only whitespace and final semicolons are removed
+        assert _squash(rendered) == _squash(expected)
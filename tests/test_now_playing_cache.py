@@ -0,0 +1,82 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import now_playing_cache
+from util.now_playing_cache import NowPlayingCache
+
+
+def _playing(progress_ms=1000, duration_ms=200000, is_playing=True):
+    return {
+        "item": {"name": "Song", "duration_ms": duration_ms},
+        "currently_playing_type": "track",
+        "is_playing": is_playing,
+        "progress_ms": progress_ms,
+    }
+
+
+def _clock(monkeypatch, start=1000.0):
+    now = [start]
+    monkeypatch.setattr(now_playing_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_progress_is_extrapolated(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = NowPlayingCache(ttl=5)
+    cache.set("u1", _playing(progress_ms=1000))
+    now[0] += 2.5
+    assert cache.get("u1")["progress_ms"] == 3500
+
+
+def test_paused_track_keeps_progress(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = NowPlayingCache(ttl=5)
+    cache.set("u1", _playing(progress_ms=1000, is_playing=False))
+    now[0] += 2
+    assert cache.get("u1")["progress_ms"] == 1000
+
+
+def test_expires_after_ttl(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = NowPlayingCache(ttl=5)
+    cache.set("u1", _playing())
+    now[0] += 5
+    assert cache.get("u1") is None
+    assert cache.get("u1", stale=True)["progress_ms"] == 6000
+
+
+def test_finished_track_is_a_miss(monkeypatch):
+    now = _clock(monkeypatch)
+    cache = NowPlayingCache(ttl=5)
+    cache.set("u1", _playing(progress_ms=199000, duration_ms=200000))
+    now[0] += 1.5
+    assert cache.get("u1") is None
+    assert cache.get("u1", stale=True) == {}
+
+
+def test_not_playing_is_cached():
+    cache = NowPlayingCache(ttl=5)
+    assert cache.get("u1") is None
+    cache.set("u1", {})
+    assert cache.get("u1") == {}
+
+
+def test_snapshot_is_not_shared():
+    cache = NowPlayingCache(ttl=5)
+    cache.set("u1", _playing())
+    cache.get("u1")["item"]["name"] = "changed"
+    assert cache.get("u1")["item"]["name"] == "Song"
+
+
+def test_disabled_and_bounded():
+    disabled = NowPlayingCache(ttl=0)
+    disabled.set("u1", _playing())
+    assert disabled.get("u1") is None
+
+    cache = NowPlayingCache(ttl=5, max_entries=2)
+    for uid in ("a", "b", "c"):
+        cache.set(uid, _playing())
+    assert len(cache) == 2
+    assert cache.get("a") is None
@@ -0,0 +1,74 @@
+import io
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+from PIL import Image
+
+from util import palette
+
+
+def _cover(color=(200, 30, 30), size=300):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), color).save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.fixture(autouse=True)
+def clear_palette():
+    palette.clear()
+    yield
+    palette.clear()
+
+
+def test_dominant_color():
+    colors = palette.extract_palette(_cover())
+    assert colors[0] == (200, 30, 30)
+
+
+def test_palette_is_memoized(monkeypatch):
+    content = _cover()
+    assert palette.cached_palette(content) is None
+    first = palette.extract_palette(content)
+
+    def boom(*args):
+        raise AssertionError("decoded twice")
+
+    monkeypatch.setattr(palette, "_extract", boom)
+    assert palette.extract_palette(content) is first
+    assert palette.cached_palette(content) is first
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(palette, "PALETTE_CACHE_MAX_ENTRIES", 2)
+    covers = [_cover((i * 50, 0, 0), size=8) for i in range(3)]
+    for content in covers:
+        palette.extract_palette(content)
+    assert palette.cached_palette(covers[0]) is None
+    assert palette.cached_palette(covers[2]) is not None
+
+
+def test_numpy_matches_colorgram():
+    rnd = random.Random(1)
+    for _ in range(10):
+        img = Image.new("RGB", (40, 30))
+        img.putdata(
+            [tuple(rnd.randrange(256) for _ in range(3)) for _ in range(40 * 30)]
+        )
+        for count in (1, 5, 12):
+            assert palette.numpy_palette(img, count) == palette.colorgram_palette(
+                img, count
+            )
+
+
+def test_extractor_is_selectable(monkeypatch):
+    calls = []
+    monkeypatch.setattr(palette, "PALETTE_EXTRACTOR", "colorgram")
+    monkeypatch.setattr(
+        palette, "colorgram_palette", lambda img, n: calls.append(n) or [(1, 2, 3)]
+    )
+    assert palette.extract_palette(_cover()) == [(1, 2, 3)]
+    assert calls == [5]
@@ -0,0 +1,93 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import spotify
+from util.play_history import PlayHistory, played_at_ms
+
+
+def _play(n, minute):
+    return {
+        "track": {"id": f"t{n}", "name": f"S{n}", "available_markets": ["TH"] * 3},
+        "played_at": f"2024-01-04T23:{minute:02d}:00.000Z",
+    }
+
+
+class FakeSpotify:
+    def __init__(self, *pages):
+        self.pages = list(pages)
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+        return {"items": self.pages.pop(0)}
+
+
+def test_played_at_ms():
+    assert played_at_ms(_play(1, 0)) == 1704409200000
+    assert played_at_ms({"played_at": "yesterday"}) is None
+    assert played_at_ms({}) is None
+
+
+def test_delta_fetch_prepends_new_plays():
+    history = PlayHistory(max_items=3, refresh_interval=0)
+    fetch = FakeSpotify([_play(2, 2), _play(1, 1)], [_play(3, 3)], [])
+
+    assert [i["track"]["id"] for i in history.refresh("u1", fetch)] == ["t2", "t1"]
+    assert fetch.calls[0] == {"limit": 3}
+
+    items = history.refresh("u1", fetch)
+    assert fetch.calls[1] == {"limit": 3, "after": played_at_ms(_play(2, 2))}
+    assert [i["track"]["id"] for i in items] == ["t3", "t2", "t1"]
+
+    history.refresh("u1", fetch)
+    assert fetch.calls[2]["after"] == played_at_ms(_play(3, 3))
+    assert len(history.items("u1")) == 3
+
+
+def test_history_is_trimmed_and_deduplicated():
+    history = PlayHistory(max_items=2, refresh_interval=0)
+    history.update("u1", {"items": [_play(1, 1)]})
+    history.update("u1", {"items": [_play(2, 2), _play(1, 1)]}, after=1)
+    assert [i["track"]["id"] for i in history.items("u1")] == ["t2", "t1"]
+    history.update("u1", {"items": [_play(3, 3)]}, after=2)
+    assert [i["track"]["id"] for i in history.items("u1")] == ["t3", "t2"]
+
+
+def test_full_delta_page_forces_full_fetch():
+    history = PlayHistory(max_items=2, refresh_interval=0)
+    history.update("u1", {"items": [_play(1, 1)]})
+    history.update("u1", {"items": [_play(3, 3), _play(2, 2)]}, after=1)
+    assert history.fetch_kwargs("u1") == {"limit": 2}
+
+
+def test_fresh_history_is_served_without_fetching():
+    history = PlayHistory(refresh_interval=60)
+    fetch = FakeSpotify([_play(1, 1)])
+    history.refresh("u1", fetch)
+    history.refresh("u1", fetch)
+    assert len(fetch.calls) == 1
+
+
+def test_items_are_slim_copies():
+    history = PlayHistory()
+    history.update("u1", {"items": [_play(1, 1)]})
+    item = history.items("u1")[0]
+    assert "available_markets" not in item["track"]
+    item["track"]["currently_playing_type"] = "track"
+    assert "currently_playing_type" not in history.items("u1")[0]["track"]
+
+
+def test_rate_limited_refresh_serves_stored_history():
+    history = PlayHistory(max_items=3, refresh_interval=0)
+    history.update("u1", {"items": [_play(1, 1)]})
+
+    def refused(**kwargs):
+        raise spotify.QuotaExceededError("over quota")
+
+    assert [i["track"]["id"] for i in history.refresh("u1", refused)] == ["t1"]
+    with pytest.raises(spotify.QuotaExceededError):
+        history.refresh("u2", refused)
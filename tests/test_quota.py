@@ -0,0 +1,62 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import quota
+from util.quota import QuotaScheduler
+
+
+def _clock(monkeypatch, start=1000.0):
+    now = [start]
+    monkeypatch.setattr(quota.time, "time", lambda: now[0])
+    return now
+
+
+def test_disabled_allows_everything():
+    scheduler = QuotaScheduler(rate=0)
+    assert all(scheduler.try_acquire("u1") for _ in range(100))
+
+
+def test_global_rate_is_enforced(monkeypatch):
+    now = _clock(monkeypatch)
+    scheduler = QuotaScheduler(rate=2, burst=4, reserve=0)
+    granted = [scheduler.try_acquire(f"u{i}") for i in range(10)]
+    assert granted.count(True) == 4
+    now[0] += 1
+    granted = [scheduler.try_acquire(f"v{i}") for i in range(10)]
+    assert granted.count(True) == 2
+
+
+def test_busy_uid_cannot_starve_others(monkeypatch):
+    now = _clock(monkeypatch)
+    scheduler = QuotaScheduler(rate=10, burst=10, reserve=0)
+    scheduler.try_acquire("quiet")
+    hot = [scheduler.try_acquire("hot") for _ in range(20)]
+    # Two active uids: the hot one only gets half of the burst
+    assert hot.count(True) == 5
+    assert scheduler.try_acquire("quiet")
+
+    now[0] += 1
+    hot = [scheduler.try_acquire("hot") for _ in range(20)]
+    assert hot.count(True) == 5
+    assert scheduler.try_acquire("quiet")
+
+
+def test_speculative_calls_leave_a_reserve(monkeypatch):
+    _clock(monkeypatch)
+    scheduler = QuotaScheduler(rate=1, burst=8, reserve=0.5)
+    speculative = [scheduler.try_acquire(f"u{i}", speculative=True) for i in range(8)]
+    assert speculative.count(True) == 4
+    visible = [scheduler.try_acquire(f"v{i}") for i in range(8)]
+    assert visible.count(True) == 4
+
+
+def test_idle_uids_leave_the_fair_share(monkeypatch):
+    now = _clock(monkeypatch)
+    scheduler = QuotaScheduler(rate=10, burst=10, window=60)
+    scheduler.try_acquire("a")
+    scheduler.try_acquire("b")
+    assert scheduler.active_uids() == 2
+    now[0] += 61
+    assert scheduler.active_uids() == 0
@@ -1,5 +1,6 @@
 import os
 import sys
+import threading
 import time
 
 import pytest
@@ -8,6 +9,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 
 from api.recently_played import app, parse_limit
 from util import spotify
+from util.play_history import PLAY_HISTORY
+from util.token_store import get_token_store
 
 
 class FakeDoc:
@@ -23,6 +26,7 @@ class FakeDoc:
 class FakeDB:
     def __init__(self, docs):
         self.docs = docs
+        self.streamed = 0
 
     def collection(self, name):
         assert name == "users"
@@ -41,6 +45,17 @@ class FakeDB:
 
         return Ref()
 
+    def limit(self, count):
+        db = self
+
+        class Query:
+            def stream(self):
+                db.streamed += 1
+                for uid in list(db.docs)[:count]:
+                    yield FakeDoc(db.docs[uid], uid)
+
+        return Query()
+
     def stream(self):
         for uid, data in self.docs.items():
             yield FakeDoc(data, uid)
@@ -49,9 +64,16 @@ class FakeDB:
 @pytest.fixture
 def client():
     app.config.update({"TESTING": True})
+    PLAY_HISTORY.clear()
+    get_token_store().cache.clear()
     return app.test_client()
 
 
+def _use_db(monkeypatch, db):
+    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    monkeypatch.setattr("util.token_store.get_firestore_db", lambda: db)
+
+
 def test_parse_limit_clamp():
     assert parse_limit(None) == 5
     assert parse_limit("0") == 1
@@ -82,7 +104,7 @@ def _base_db():
 
 def test_empty_list_returns_message(client, monkeypatch):
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr(
         "util.spotify.get_recently_played", lambda token, limit=5: {"items": []}
     )
@@ -93,7 +115,7 @@ def test_empty_list_returns_message(client, monkeypatch):
 
 def test_error_rate_limit_returns_svg(client, monkeypatch):
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr(
         "util.spotify.get_recently_played",
         lambda *a, **k: (_ for _ in ()).throw(spotify.RateLimitError("x")),
@@ -115,7 +137,7 @@ def test_success_path(client, monkeypatch):
         for i in range(5)
     ]
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr(
         "util.spotify.get_recently_played", lambda token, limit=5: {"items": items}
     )
@@ -128,7 +150,7 @@ def test_success_path(client, monkeypatch):
 def test_token_refresh_flow(client, monkeypatch):
     items = {"items": [{"track": {"name": "S", "artists": [{"name": "A"}], "album": {"images": [{"url": "https://img/1"}]}}}]}
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
 
     calls = {"refresh": 0, "play": 0}
 
@@ -170,7 +192,7 @@ def test_snapshot_svg(client, monkeypatch):
         },
     ]
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr(
         "util.spotify.get_recently_played", lambda *a, **k: {"items": items}
     )
@@ -183,7 +205,7 @@ def test_snapshot_svg(client, monkeypatch):
 def test_etag_support(client, monkeypatch):
     items = {"items": [{"track": {"name": "S", "artists": [{"name": "A"}], "album": {"images": [{"url": "https://img/1"}]}}}]}
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr("util.spotify.get_recently_played", lambda *a, **k: items)
     first = client.get("/api/recently-played?uid=u1")
     etag = first.headers["ETag"]
@@ -193,3 +215,124 @@ def test_etag_support(client, monkeypatch):
     assert first.status_code == 200
     assert second.status_code == 304
     assert second.data == b""
+
+
+def test_default_user_lookup_is_cached(client, monkeypatch):
+    items = {"items": [{"track": {"name": "S", "artists": [{"name": "A"}], "album": {"images": [{"url": "https://img/1"}]}}}]}
+    db = _base_db()
+    _use_db(monkeypatch, db)
+    monkeypatch.setattr("api.recently_played._default_uid_cache", ["", 0.0])
+    monkeypatch.setattr("util.spotify.get_recently_played", lambda *a, **k: items)
+    first = client.get("/api/recently-played")
+    second = client.get("/api/recently-played")
+    assert b"<image" in first.data and b"<image" in second.data
+    assert db.streamed == 1
+
+    db.docs["u2"] = dict(db.docs["u1"])
+    monkeypatch.setattr("api.recently_played._default_uid_cache", ["", 0.0])
+    resp = client.get("/api/recently-played")
+    assert b"Please provide ?uid" in resp.data
+
+
+def test_spotify_theme_fetches_covers_within_deadline(client, monkeypatch):
+    items = [
+        {
+            "track": {
+                "name": f"T{i}",
+                "artists": [{"name": "A"}],
+                "album": {"images": [{"url": f"https://img/{i}"}]},
+            }
+        }
+        for i in range(4)
+    ]
+    release = threading.Event()
+
+    def fake_fetch(url, **k):
+        if url == "https://img/3":
+            release.wait(2)
+            return "data:image/png;base64,late"
+        time.sleep(0.1)
+        return "data:image/png;base64,ok"
+
+    db = _base_db()
+    _use_db(monkeypatch, db)
+    monkeypatch.setattr(
+        "util.spotify.get_recently_played", lambda *a, **k: {"items": items}
+    )
+    monkeypatch.setattr("api.recently_played.fetch_data_uri", fake_fetch)
+    monkeypatch.setattr("api.recently_played.COVER_FETCH_DEADLINE", 0.25)
+    try:
+        body = client.get("/api/recently-played?uid=u1&theme=spotify").data.decode()
+    finally:
+        release.set()
+    # Three 0.1s fetches fit the deadline only when run concurrently
+    assert body.count("base64,ok") == 3
+    assert "base64,late" not in body
+    assert body.count('fill="#2B2F33"') == 1
+
+
+def test_etag_is_checked_before_fetching_covers(client, monkeypatch):
+    items = [
+        {
+            "track": {
+                "name": "T1",
+                "artists": [{"name": "A"}],
+                "album": {"images": [{"url": "https://img/1"}]},
+            },
+            "played_at": "2024-01-04T23:59:00Z",
+        }
+    ]
+    db = _base_db()
+    _use_db(monkeypatch, db)
+    monkeypatch.setattr(
+        "util.spotify.get_recently_played", lambda *a, **k: {"items": items}
+    )
+    monkeypatch.setattr(
+        "api.recently_played.fetch_data_uri", lambda url, **k: "data:image/png;base64,"
+    )
+    first = client.get("/api/recently-played?uid=u1&theme=spotify")
+    etag = first.headers["ETag"]
+    assert (
+        first.headers["Cache-Control"]
+        == "public, max-age=60, stale-while-revalidate=30"
+    )
+
+    monkeypatch.setattr(
+        "api.recently_played.fetch_data_uri", lambda *a, **k: pytest.fail("fetched")
+    )
+    second = client.get(
+        "/api/recently-played?uid=u1&theme=spotify", headers={"If-None-Match": etag}
+    )
+    assert second.status_code == 304
+
+
+def test_over_quota_serves_stored_history(client, monkeypatch):
+    _use_db(monkeypatch, _base_db())
+    monkeypatch.setattr(PLAY_HISTORY, "refresh_interval", 0)
+    track = {"name": "Old", "artists": [{"name": "A"}], "album": {"images": []}}
+    PLAY_HISTORY.update("u1", {"items": [{"track": track}]})
+
+    def refuse(uid):
+        raise spotify.QuotaExceededError("over quota")
+
+    monkeypatch.setattr("util.spotify.acquire_quota", refuse)
+    resp = client.get("/api/recently-played?uid=u1")
+    assert b"Old" in resp.data
+    assert b"rate limit" not in resp.data.lower()
+
+
+def test_cached_token_requests_skip_firestore(client, monkeypatch):
+    db = _base_db()
+    monkeypatch.setattr("util.token_store.get_firestore_db", lambda: db)
+    get_token_store().get("u1")
+    monkeypatch.setattr("util.token_store.get_firestore_db", _no_db)
+    monkeypatch.setattr("api.recently_played.get_firestore_db", _no_db)
+    monkeypatch.setattr(
+        "util.spotify.get_recently_played", lambda token, limit=5: {"items": []}
+    )
+    resp = client.get("/api/recently-played?uid=u1")
+    assert b"No recent tracks" in resp.data
+
+
+def _no_db():
+    raise AssertionError("Firestore opened")
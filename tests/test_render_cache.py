@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import render_cache
+from util.render_cache import RenderCache, bucket_progress, fingerprint
+
+
+def test_fingerprint_is_stable_and_typed():
+    assert fingerprint("spotify:track:1", True, None) == fingerprint(
+        "spotify:track:1", True, None
+    )
+    assert fingerprint("a", 1) != fingerprint("a", "1")
+    assert fingerprint("a|b") != fingerprint("a", "b")
+
+
+def test_evicts_least_recently_used_by_length():
+    cache = RenderCache(max_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"
+    cache.put("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") and cache.get("c")
+    assert cache.size == 8 and len(cache) == 2
+
+    cache.put("huge", "x" * 11)
+    assert cache.get("huge") is None
+
+
+def test_bucket_progress(monkeypatch):
+    monkeypatch.setattr(render_cache, "RENDER_PROGRESS_BUCKET_MS", 5000)
+    assert bucket_progress(None) is None
+    assert bucket_progress(0) == 0
+    assert bucket_progress(12345) == 10000
@@ -0,0 +1,46 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util import singleflight
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+    results = []
+
+    def refresh():
+        calls.append(1)
+        time.sleep(0.1)
+        return "new-token"
+
+    threads = [
+        threading.Thread(target=lambda: results.append(singleflight.do("k", refresh)))
+        for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert results == ["new-token"] * 8
+
+
+def test_error_is_shared_and_key_released():
+    def boom():
+        raise RuntimeError("refresh failed")
+
+    with pytest.raises(RuntimeError):
+        singleflight.do("k", boom)
+    assert singleflight.do("k", lambda: "ok") == "ok"
+
+
+def test_file_lock_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr("util.singleflight.SINGLEFLIGHT_LOCK_DIR", str(tmp_path))
+    assert singleflight.do("token:u1", lambda: 42) == 42
+    assert len(list(tmp_path.iterdir())) == 1
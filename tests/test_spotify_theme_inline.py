@@ -8,6 +8,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")
 
 from api.recently_played import app
 from util import spotify
+from util.play_history import PLAY_HISTORY
+from util.token_store import get_token_store
 
 
 class FakeDoc:
@@ -61,9 +63,16 @@ def _base_db():
 @pytest.fixture
 def client():
     app.config.update({"TESTING": True})
+    PLAY_HISTORY.clear()
+    get_token_store().cache.clear()
     return app.test_client()
 
 
+def _use_db(monkeypatch, db):
+    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    monkeypatch.setattr("util.token_store.get_firestore_db", lambda: db)
+
+
 def test_spotify_theme_inlines_images(client, monkeypatch):
     items = [
         {
@@ -77,15 +86,15 @@ def test_spotify_theme_inlines_images(client, monkeypatch):
         for i in range(3)
     ]
     db = _base_db()
-    monkeypatch.setattr("api.recently_played.get_firestore_db", lambda: db)
+    _use_db(monkeypatch, db)
     monkeypatch.setattr(
         "util.spotify.get_recently_played", lambda token, limit=3: {"items": items}
     )
     tiny_png = (
         "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR4nGNgYAAAAAMAASsJTYQAAAAASUVORK5CYII="
     )
-    monkeypatch.setattr("util.images.fetch_data_uri", lambda url: tiny_png)
-    monkeypatch.setattr("api.recently_played.fetch_data_uri", lambda url: tiny_png)
+    monkeypatch.setattr("util.images.fetch_data_uri", lambda url, **k: tiny_png)
+    monkeypatch.setattr("api.recently_played.fetch_data_uri", lambda url, **k: tiny_png)
 
     from datetime import datetime, timezone
 
@@ -0,0 +1,93 @@
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import pytest
+from flask import render_template
+
+from api import view
+from util.themes import (
+    THEMES,
+    fill_skeleton,
+    get_theme,
+    slot,
+    split_skeleton,
+    theme_name,
+)
+
+TEMPLATES = sorted(
+    name[len("spotify.") : -len(".html.j2")]
+    for name in os.listdir(os.path.join(os.path.dirname(view.__file__), "templates"))
+    if name.startswith("spotify.")
+)
+
+
+def _jinja_render(artist, song, img, playing, cover, theme, bar, offline, bg, mode):
+    """Full template render with the values make_svg used to compute."""
+    meta = get_theme(theme)
+    if playing:
+        title, content_bar = "Now playing", meta.content_bar
+        css_bar = view.generate_css_bar(meta.num_bar)
+    elif offline:
+        title, content_bar, css_bar = "Not playing", "", None
+    else:
+        title, content_bar = "Recently played", ""
+        css_bar = view.generate_css_bar(meta.num_bar)
+    progress = {}
+    if meta.progress:
+        progress = view.calculate_progress_data(61000 if playing else 0, 200000)
+        if playing:
+            progress["remaining_seconds"] = "139"
+    return render_template(
+        meta.template,
+        height=meta.card_height(cover),
+        num_bar=meta.num_bar,
+        content_bar=content_bar,
+        css_bar=css_bar,
+        title_text=title,
+        artist_name=view.encode_html_entities(artist),
+        song_name=view.encode_html_entities(song),
+        img=img,
+        cover_image=cover,
+        bar_color=bar,
+        background_color=bg,
+        mode=mode,
+        is_now_playing=playing,
+        progress_data=progress,
+        animate_progress=meta.progress and playing,
+    )
+
+
+def test_registry_covers_every_template():
+    assert set(THEMES) == set(TEMPLATES)
+    assert get_theme("karaoke").template == "spotify.karaoke.html.j2"
+    assert get_theme("karaoke") is get_theme("karaoke")
+    assert theme_name("karaoke") == "karaoke"
+    assert theme_name("../secret") == "default"
+
+
+def test_skeleton_round_trip():
+    skeleton = split_skeleton(f"<a>{slot('x')}</a>{slot('y')}")
+    assert skeleton == ("<a>", "x", "</a>", "y", "")
+    assert fill_skeleton(skeleton, {"x": "1", "y": 2.5}) == "<a>1</a>2.5"
+
+
+@pytest.mark.parametrize("theme", TEMPLATES)
+def test_skeleton_matches_full_render(theme):
+    view.card_skeleton.cache_clear()
+    variants = itertools.product(
+        [True, False],  # is_now_playing
+        [True, False],  # cover_image
+        [True, False],  # show_offline
+        ["light", "dark"],
+        ["Song <&>", ""],
+        ["aW1n", ""],
+    )
+    with view.app.test_request_context():
+        for playing, cover, offline, mode, song, img in variants:
+            args = ("Artist's", song, img, playing, cover, theme, "53b14f")
+            args += (offline, "121212", mode)
+            expected = _jinja_render(*args)
+            assert view.make_svg(*args, 61000, 200000) == expected
@@ -0,0 +1,61 @@
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from PIL import Image
+
+from util import images
+from util.thumbnails import make_thumbnail
+
+
+def _jpeg(px):
+    img = Image.new("RGB", (px, px))
+    for x in range(px):
+        for y in range(0, px, 7):
+            img.putpixel((x, y), (x % 256, y % 256, (x * y) % 256))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=95)
+    return out.getvalue()
+
+
+def test_downscales_to_drawn_size():
+    original = _jpeg(300)
+    thumb = make_thumbnail(original, 64)
+    assert len(thumb) < len(original)
+    assert Image.open(io.BytesIO(thumb)).size == (64, 64)
+
+
+def test_small_or_broken_images_are_kept():
+    small = _jpeg(48)
+    assert make_thumbnail(small, 64) is small
+    assert make_thumbnail(b"not an image", 64) == b"not an image"
+
+
+def test_thumbnails_are_cached_per_size(monkeypatch):
+    original = _jpeg(300)
+    calls = []
+
+    class Response:
+        status_code = 200
+        content = original
+        headers = {"Content-Type": "image/jpeg"}
+
+    class Session:
+        def get(self, url, **kwargs):
+            calls.append(url)
+            return Response()
+
+    monkeypatch.setattr(images, "get_session", lambda: Session())
+    images.IMAGE_CACHE.clear()
+    try:
+        small = images.load_image("https://img/1", size=64)
+        assert Image.open(io.BytesIO(small)).size == (64, 64)
+        assert images.load_image("https://img/1", size=64) is small
+        medium = images.fetch_data_uri("https://img/1", size=80)
+        assert medium.startswith("data:image/jpeg;base64,")
+        assert images.load_image("https://img/1") == original
+        assert calls == ["https://img/1"]
+    finally:
+        images.IMAGE_CACHE.clear()
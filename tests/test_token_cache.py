@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util.token_cache import (
+    TOKEN_CACHE_TOUCH_INTERVAL,
+    MemoryTokenCache,
+    SQLiteTokenCache,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryTokenCache(max_entries=2, ttl=60)
+    cache.set("a", {"access_token": "a"})
+    cache.set("b", {"access_token": "b"})
+    assert cache.get("a")["access_token"] == "a"
+    cache.set("c", {"access_token": "c"})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert len(cache) == 2
+
+
+def test_memory_cache_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("util.token_cache.time", clock)
+    cache = MemoryTokenCache(max_entries=10, ttl=60)
+    cache.set("a", {"access_token": "a"})
+    clock.now += 59
+    assert cache.get("a") is not None
+    clock.now += 1
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_shared_between_instances(tmp_path):
+    path = str(tmp_path / "tokens.sqlite3")
+    first = SQLiteTokenCache(path, max_entries=2, ttl=60)
+    second = SQLiteTokenCache(path, max_entries=2, ttl=60)
+    first.set("a", {"access_token": "a", "expired_ts": 1})
+    assert second.get("a") == {"access_token": "a", "expired_ts": 1}
+    second.set("b", {"access_token": "b"})
+    second.set("c", {"access_token": "c"})
+    assert len(first) == 2
+    first.delete("c")
+    assert second.get("c") is None
+
+
+def test_sqlite_cache_file_is_private(tmp_path):
+    path = str(tmp_path / "tokens.sqlite3")
+    cache = SQLiteTokenCache(path)
+    cache.set("a", {"refresh_token": "secret"})
+    for name in os.listdir(tmp_path):
+        assert os.stat(tmp_path / name).st_mode & 0o777 == 0o600
+
+
+def test_sqlite_cache_errors_are_misses(tmp_path, monkeypatch):
+    cache = SQLiteTokenCache(str(tmp_path / "tokens.sqlite3"))
+
+    def locked():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(cache, "_conn", locked)
+    cache.set("a", {"access_token": "a"})
+    assert cache.get("a") is None
+    cache.delete("a")
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_sqlite_cache_hits_touch_entries_rarely(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("util.token_cache.time", clock)
+    cache = SQLiteTokenCache(str(tmp_path / "tokens.sqlite3"), ttl=3600)
+    cache.set("a", {"access_token": "a"})
+
+    def accessed_at():
+        row = cache._conn().execute("SELECT accessed_at FROM token_cache").fetchone()
+        return row[0]
+
+    clock.now += 1
+    cache.get("a")
+    assert accessed_at() == 1000.0
+    clock.now += TOKEN_CACHE_TOUCH_INTERVAL
+    cache.get("a")
+    assert accessed_at() == clock.now
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from util.token_refresher import TokenRefresher
+
+
+def test_refreshes_only_active_tokens_near_expiry():
+    now = int(time.time())
+    tokens = {
+        "soon": {"refresh_token": "r", "expired_ts": now + 60},
+        "later": {"refresh_token": "r", "expired_ts": now + 3000},
+        "idle": {"refresh_token": "r", "expired_ts": now + 60},
+    }
+    refreshed = []
+    refresher = TokenRefresher(
+        tokens.get,
+        lambda uid, info: refreshed.append(uid),
+        margin=300,
+        active_window=600,
+    )
+    refresher.touch("soon")
+    refresher.touch("later")
+    refresher.touch("idle")
+    refresher._active["idle"] = time.time() - 700
+    refresher._active.move_to_end("idle", last=False)
+
+    assert refresher.run_once() == 1
+    assert refreshed == ["soon"]
+    assert refresher.active_uids() == ["soon", "later"]
+
+
+def test_refresh_errors_do_not_stop_the_loop():
+    def fail(uid, info):
+        raise RuntimeError("spotify down")
+
+    refresher = TokenRefresher(
+        lambda uid: {"refresh_token": "r", "expired_ts": 0}, fail, margin=300
+    )
+    refresher.touch("u1")
+    assert refresher.run_once() == 0
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from conftest import FakeDB
+from util.token_cache import MemoryTokenCache
+from util.token_store import TokenStore, get_token_store, normalize_token_info
+
+
+def _store(docs):
+    db = FakeDB(docs)
+    return db, TokenStore(lambda: db, cache=MemoryTokenCache())
+
+
+def test_legacy_expiry_is_migrated_on_read():
+    info = normalize_token_info({"access_token": "t", "token_expired_timestamp": 50})
+    assert info == {"access_token": "t", "expired_ts": 50}
+    info = normalize_token_info({"expired_ts": 80, "token_expired_timestamp": 50})
+    assert info == {"expired_ts": 80}
+
+
+def test_legacy_document_is_not_refreshed_again(monkeypatch):
+    db, store = _store(
+        {
+            "u1": {
+                "access_token": "t",
+                "refresh_token": "r",
+                "token_expired_timestamp": int(time.time()) + 600,
+            }
+        }
+    )
+    monkeypatch.setattr(
+        "util.spotify.refresh_token", lambda r: (_ for _ in ()).throw(AssertionError)
+    )
+    assert store.get_access_token("u1") == "t"
+    assert store.get_access_token("u1") == "t"
+    assert db.reads == 1
+
+
+def test_refresh_writes_canonical_schema(monkeypatch):
+    db, store = _store(
+        {"u1": {"access_token": "t", "refresh_token": "r", "expired_ts": 0}}
+    )
+    calls = []
+
+    def fake_refresh(refresh):
+        calls.append(refresh)
+        return {"access_token": "new", "expires_in": 3600}
+
+    monkeypatch.setattr("util.spotify.refresh_token", fake_refresh)
+    assert store.get_access_token("u1") == "new"
+    assert calls == ["r"]
+    assert db.docs["u1"]["expired_ts"] > time.time() + 3000
+    # A second endpoint sharing the document reuses the refreshed token
+    other = TokenStore(lambda: db, cache=MemoryTokenCache())
+    assert other.get_access_token("u1") == "new"
+    assert calls == ["r"]
+
+
+def test_revoked_refresh_token_deletes_user(monkeypatch):
+    db, store = _store(
+        {"u1": {"access_token": "t", "refresh_token": "r", "expired_ts": 0}}
+    )
+    monkeypatch.setattr(
+        "util.spotify.refresh_token", lambda r: {"error": "invalid_grant"}
+    )
+    assert store.get_access_token("u1") is None
+    assert "u1" not in db.docs
+    assert store.cache.get("u1") is None
+
+
+def test_endpoints_share_one_store():
+    from api import callback, recently_played, view
+
+    assert view.TOKEN_STORE is get_token_store()
+    assert recently_played.TOKEN_STORE is get_token_store()
+    assert callback.TOKEN_STORE is get_token_store()
@@ -0,0 +1,354 @@
+import gzip
+import io
+import os
+import sys
+import threading
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api import view
+from api.view import NOW_PLAYING_CACHE, RENDER_CACHE, app
+from conftest import track
+from util import spotify
+from util.play_history import PLAY_HISTORY
+
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+    "0000000d49444154789c63f8cfc0f01f0005000201a5e9a3a00000000049454e44ae426082"
+)
+
+
+@pytest.fixture
+def client(monkeypatch, fake_db):
+    app.config.update({"TESTING": True})
+    NOW_PLAYING_CACHE.clear()
+    RENDER_CACHE.clear()
+    PLAY_HISTORY.clear()
+    monkeypatch.setattr("api.view.load_image", lambda url, **k: TINY_PNG)
+    return app.test_client()
+
+
+def test_missing_uid(client):
+    assert client.get("/api/view").data == b"not ok"
+
+
+def test_now_playing_card(client, monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {
+            "item": track("Song <1>"),
+            "currently_playing_type": "track",
+            "progress_ms": 1000,
+        },
+    )
+    resp = client.get("/api/view?uid=u1")
+    assert resp.status_code == 200
+    assert resp.mimetype == "image/svg+xml"
+    svg = resp.data.decode()
+    assert "Now playing" in svg
+    assert "Song &lt;1&gt;" in svg
+    assert "Artist" in svg
+    assert "base64, iVBORw0KGgo" in svg
+
+
+def test_recently_played_fallback(client, monkeypatch):
+    monkeypatch.setattr("util.spotify.get_now_playing", lambda token: {})
+    monkeypatch.setattr(
+        "util.spotify.get_recently_played",
+        lambda token, **k: {"items": [{"track": track("Old")}]},
+    )
+    svg = client.get("/api/view?uid=u1&cover_image=false").data.decode()
+    assert "Recently played" in svg
+    assert "Old" in svg
+
+
+def test_show_offline(client, monkeypatch):
+    monkeypatch.setattr("util.spotify.get_now_playing", lambda token: {})
+    svg = client.get("/api/view?uid=u1&show_offline=true").data.decode()
+    assert "Currently not playing on Spotify" in svg
+
+
+def test_redirect(client, monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    resp = client.get("/api/view?uid=u1&redirect=true")
+    assert resp.status_code == 302
+    assert resp.headers["Location"] == "spotify:track:1"
+
+
+def test_unknown_user(client):
+    resp = client.get("/api/view?uid=nobody")
+    assert b"Invalid Spotify access_token" in resp.data
+
+
+def test_now_playing_is_reused_within_ttl(client, monkeypatch):
+    calls = []
+
+    def now_playing(token):
+        calls.append(token)
+        return {
+            "item": track(),
+            "currently_playing_type": "track",
+            "is_playing": True,
+            "progress_ms": 1000,
+        }
+
+    monkeypatch.setattr("util.spotify.get_now_playing", now_playing)
+    for _ in range(3):
+        assert b"Now playing" in client.get("/api/view?uid=u1").data
+    assert len(calls) == 1
+
+
+def test_rate_limited_serves_last_snapshot(client, monkeypatch):
+    playing = {
+        "item": track("Cached"),
+        "currently_playing_type": "track",
+        "is_playing": False,
+        "progress_ms": 1000,
+    }
+    NOW_PLAYING_CACHE.set("u1", playing)
+    monkeypatch.setattr(NOW_PLAYING_CACHE, "ttl", 1e-9)
+
+    def throttled(*a, **k):
+        raise spotify.CircuitOpenError("backing off", retry_after=5)
+
+    monkeypatch.setattr("util.spotify.get_now_playing", throttled)
+    monkeypatch.setattr("util.spotify.get_recently_played", throttled)
+    assert b"Cached" in client.get("/api/view?uid=u1").data
+
+    NOW_PLAYING_CACHE.clear()
+    svg = client.get("/api/view?uid=u1").data.decode()
+    assert "Currently not playing on Spotify" in svg
+
+
+@pytest.mark.parametrize(
+    "error", [spotify.SpotifyTimeoutError("timeout"), spotify.SpotifyServerError("503")]
+)
+def test_unavailable_spotify_serves_last_snapshot(client, monkeypatch, error):
+    NOW_PLAYING_CACHE.set(
+        "u1",
+        {"item": track("Cached"), "currently_playing_type": "track", "progress_ms": 0},
+    )
+    monkeypatch.setattr(NOW_PLAYING_CACHE, "ttl", 1e-9)
+
+    def down(*a, **k):
+        raise error
+
+    monkeypatch.setattr("util.spotify.get_now_playing", down)
+    resp = client.get("/api/view?uid=u1")
+    assert resp.status_code == 200
+    assert b"Cached" in resp.data
+
+
+def test_rejected_token_is_refreshed_once(client, monkeypatch):
+    calls = []
+
+    def now_playing(token):
+        calls.append(token)
+        if token == "t":
+            raise spotify.InvalidTokenError("expired")
+        return {
+            "item": track("Fresh"),
+            "currently_playing_type": "track",
+            "progress_ms": 1000,
+        }
+
+    monkeypatch.setattr("util.spotify.get_now_playing", now_playing)
+    monkeypatch.setattr(
+        "util.spotify.refresh_token", lambda r: {"access_token": "new"}
+    )
+    assert b"Fresh" in client.get("/api/view?uid=u1").data
+    assert calls == ["t", "new"]
+
+
+def test_over_quota_serves_offline_card(client, monkeypatch):
+    monkeypatch.setattr(spotify.QUOTA, "try_acquire", lambda uid, spec=False: False)
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: pytest.fail("over budget calls must not reach Spotify"),
+    )
+    svg = client.get("/api/view?uid=u1").data.decode()
+    assert "Currently not playing on Spotify" in svg
+
+
+def test_recently_played_is_prefetched_concurrently(client, monkeypatch):
+    monkeypatch.setattr("api.view.PREFETCH_RECENTLY_PLAYED", True)
+    started = threading.Event()
+
+    def now_playing(token):
+        # Only returns if recently played was already requested in parallel
+        assert started.wait(2)
+        return {}
+
+    def recently_played(token, **k):
+        started.set()
+        return {"items": [{"track": track("Old")}]}
+
+    monkeypatch.setattr("util.spotify.get_now_playing", now_playing)
+    monkeypatch.setattr("util.spotify.get_recently_played", recently_played)
+    svg = client.get("/api/view?uid=u1&cover_image=false").data.decode()
+    assert "Recently played" in svg
+    assert "Old" in svg
+
+
+def test_bar_color_from_cover(client, monkeypatch):
+    out = io.BytesIO()
+    Image.new("RGB", (300, 300), (200, 30, 30)).save(out, "PNG")
+    monkeypatch.setattr("api.view.load_image", lambda url, **k: out.getvalue())
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    svg = client.get("/api/view?uid=u1&bar_color_cover=true").data.decode()
+    assert "c81e1e" in svg
+
+
+def test_rendered_card_is_reused(client, monkeypatch):
+    loads = []
+    monkeypatch.setattr(NOW_PLAYING_CACHE, "ttl", 0)
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    monkeypatch.setattr(
+        "api.view.load_image", lambda url, **k: loads.append(url) or TINY_PNG
+    )
+    first = client.get("/api/view?uid=u1").data
+    assert client.get("/api/view?uid=u1").data == first
+    assert len(loads) == 1
+
+    # Different parameters are a different card
+    assert client.get("/api/view?uid=u1&theme=compact").data != first
+    assert len(loads) == 2
+
+
+def test_unknown_theme_renders_default_card(client, monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    resp = client.get("/api/view?uid=u1&theme=nope")
+    assert resp.status_code == 200
+    assert resp.data == client.get("/api/view?uid=u1").data
+
+
+def test_card_without_cover_is_not_reused(client, monkeypatch):
+    loads = []
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    monkeypatch.setattr(
+        "api.view.load_image", lambda url, **k: loads.append(url) or b""
+    )
+    client.get("/api/view?uid=u1")
+    client.get("/api/view?uid=u1")
+    assert len(loads) == 2
+
+
+def test_card_is_gzipped_once(client, monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    compressed = []
+    compress = view.compress
+    monkeypatch.setattr(
+        "api.view.compress", lambda *a: compressed.append(a[1]) or compress(*a)
+    )
+    plain = client.get("/api/view?uid=u1").data
+    headers = {"Accept-Encoding": "gzip"}
+    for _ in range(2):
+        resp = client.get("/api/view?uid=u1", headers=headers)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(resp.data) == plain
+    assert compressed == ["gzip"]
+
+
+def test_card_is_brotli_compressed(client, monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    plain = client.get("/api/view?uid=u1").data
+    resp = client.get("/api/view?uid=u1", headers={"Accept-Encoding": "gzip, br"})
+    assert resp.headers["Content-Encoding"] == "br"
+    assert brotli.decompress(resp.data) == plain
+
+
+def test_etag_answers_304_without_rendering(client, monkeypatch):
+    monkeypatch.setattr(
+        "util.spotify.get_now_playing",
+        lambda token: {"item": track(), "currently_playing_type": "track"},
+    )
+    first = client.get("/api/view?uid=u1")
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"].startswith("public, max-age=")
+
+    # Another worker: nothing cached, same tag
+    RENDER_CACHE.clear()
+    monkeypatch.setattr("api.view.load_image", lambda *a, **k: pytest.fail("loaded"))
+    monkeypatch.setattr("api.view.render_card", lambda *a: pytest.fail("rendered"))
+    resp = client.get("/api/view?uid=u1", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.headers["ETag"] == etag
+
+
+def test_card_is_cached_until_the_track_ends(client, monkeypatch):
+    playing = {
+        "item": track(),
+        "currently_playing_type": "track",
+        "is_playing": True,
+        "progress_ms": 20000,
+    }
+    monkeypatch.setattr(NOW_PLAYING_CACHE, "ttl", 0)
+    monkeypatch.setattr("util.spotify.get_now_playing", lambda token: playing)
+    resp = client.get("/api/view?uid=u1")
+    assert resp.headers["Cache-Control"].startswith("public, max-age=180,")
+
+    playing["item"] = dict(track(), duration_ms=3 * 3600 * 1000)
+    resp = client.get("/api/view?uid=u1")
+    assert resp.headers["Cache-Control"].startswith("public, max-age=900,")
+
+
+def test_progress_card_expires_before_it_lags(client, monkeypatch):
+    playing = {
+        "item": track(),
+        "currently_playing_type": "track",
+        "is_playing": True,
+        "progress_ms": 20000,
+    }
+    monkeypatch.setattr(NOW_PLAYING_CACHE, "ttl", 0)
+    monkeypatch.setattr("util.spotify.get_now_playing", lambda token: playing)
+    resp = client.get("/api/view?uid=u1&theme=apple")
+    assert resp.headers["Cache-Control"] == "public, max-age=30"
+    svg = resp.data.decode()
+    # The progress bar runs to the end of the track on the client, without
+    # time labels that would fall behind it
+    assert "animation-duration:180s" in svg
+    assert "-3:00" not in svg
+
+    playing["progress_ms"] = 193000
+    resp = client.get("/api/view?uid=u1&theme=apple")
+    assert resp.headers["Cache-Control"] == "public, max-age=2"
+
+    playing["is_playing"] = False
+    resp = client.get("/api/view?uid=u1&theme=apple")
+    assert resp.headers["Cache-Control"] == "public, max-age=1"
+    svg = resp.data.decode()
+    assert "animation-duration" not in svg
+    assert "3:13" in svg and "-0:07" in svg
+
+
+def test_offline_card_is_cached_longer(client, monkeypatch):
+    monkeypatch.setattr("util.spotify.get_now_playing", lambda token: {})
+    resp = client.get("/api/view?uid=u1&show_offline=true")
+    assert resp.headers["Cache-Control"].startswith("public, max-age=60,")
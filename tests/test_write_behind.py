@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from conftest import FakeDB
+from util.token_cache import MemoryTokenCache
+from util.token_store import TokenStore
+from util.write_behind import WriteBehindQueue
+
+
+def test_updates_are_coalesced_into_one_batch():
+    db = FakeDB({}, direct_writes=False)
+    queue = WriteBehindQueue(lambda: db, interval=3600)
+    queue.put("u1", {"access_token": "a", "expired_ts": 1})
+    queue.put("u1", {"access_token": "b", "expired_ts": 2})
+    queue.put("u2", {"access_token": "c"})
+    assert queue.flush() == 2
+    assert db.commits == 1
+    assert db.docs == {
+        "u1": {"access_token": "b", "expired_ts": 2},
+        "u2": {"access_token": "c"},
+    }
+    assert queue.flush() == 0
+
+
+def test_failed_flush_is_requeued_under_newer_updates():
+    db = FakeDB({}, direct_writes=False)
+    queue = WriteBehindQueue(lambda: db, interval=3600)
+    queue.put("u1", {"access_token": "a", "expired_ts": 1})
+    db.fail = True
+    assert queue.flush() == 0
+    queue.put("u1", {"access_token": "b"})
+    db.fail = False
+    assert queue.flush() == 1
+    assert db.docs["u1"] == {"access_token": "b", "expired_ts": 1}
+
+
+def test_store_serves_pending_token_before_flush(monkeypatch):
+    db = FakeDB(
+        {"u1": {"access_token": "t", "refresh_token": "r", "expired_ts": 0}},
+        direct_writes=False,
+    )
+    queue = WriteBehindQueue(lambda: db, interval=3600)
+    store = TokenStore(lambda: db, cache=MemoryTokenCache(), writer=queue)
+    monkeypatch.setattr(
+        "util.spotify.refresh_token",
+        lambda r: {"access_token": "new", "expires_in": 3600},
+    )
+    assert store.get_access_token("u1") == "new"
+    assert db.docs["u1"]["access_token"] == "t"
+
+    # Even if the cache entry is gone, the pending update wins over Firestore
+    store.cache.clear()
+    assert store.get_access_token("u1") == "new"
+    queue.flush()
+    assert db.docs["u1"]["access_token"] == "new"
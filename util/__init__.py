@@ -0,0 +1,5 @@
+from dotenv import find_dotenv, load_dotenv
+
+# util modules read their settings from the environment when imported, so
+# .env is loaded before any of them
+load_dotenv(find_dotenv())
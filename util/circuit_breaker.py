@@ -0,0 +1,96 @@
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+# Consecutive 429/5xx/timeouts that open the breaker
+SPOTIFY_BREAKER_THRESHOLD = int(os.getenv("SPOTIFY_BREAKER_THRESHOLD", "5"))
+# Seconds the breaker stays open before a single probe call is let through
+SPOTIFY_BREAKER_RESET = float(os.getenv("SPOTIFY_BREAKER_RESET", "30"))
+# Back-off after a 429 that carries no Retry-After header
+SPOTIFY_RETRY_AFTER_DEFAULT = float(os.getenv("SPOTIFY_RETRY_AFTER_DEFAULT", "5"))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Client-wide back-off for an upstream API shared by every user.
+
+    A 429 blocks all calls until its Retry-After has passed. After
+    ``threshold`` consecutive failures (429, 5xx or timeouts) the breaker
+    opens for ``reset_timeout`` seconds; then one probe call is let through
+    and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(
+        self,
+        threshold: int = SPOTIFY_BREAKER_THRESHOLD,
+        reset_timeout: float = SPOTIFY_BREAKER_RESET,
+        default_retry_after: float = SPOTIFY_RETRY_AFTER_DEFAULT,
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.default_retry_after = default_retry_after
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def wait_time(self) -> float:
+        """Return seconds until a call may be made; ``0`` allows it now."""
+        now = time.time()
+        with self._lock:
+            if self._blocked_until > now:
+                return self._blocked_until - now
+            if self._opened_at is None:
+                return 0.0
+            reopen_at = self._opened_at + self.reset_timeout
+            if reopen_at > now:
+                return reopen_at - now
+            # Half-open: this caller is the probe, everyone else keeps waiting
+            self._opened_at = now
+            return 0.0
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        now = time.time()
+        with self._lock:
+            if retry_after is not None:
+                self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = now
+
+    def record_rate_limit(self, retry_after: Optional[float] = None) -> float:
+        """Record a 429 and return the back-off that was applied."""
+        if retry_after is None:
+            retry_after = self.default_retry_after
+        self.record_failure(retry_after)
+        return retry_after
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._blocked_until = 0.0
@@ -0,0 +1,57 @@
+import gzip
+import os
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Smaller bodies are sent as is
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "512"))
+
+
+def _accepted(accept_encoding: str) -> dict:
+    codings = {}
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            codings[coding] = q
+    return codings
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """Content coding to answer with: ``"br"``, ``"gzip"`` or ``None``."""
+    codings = _accepted(accept_encoding)
+    wildcard = codings.get("*", 0.0)
+    if brotli is not None and codings.get("br", wildcard) > 0:
+        return "br"
+    if codings.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def choose_encoding(body: bytes, accept_encoding: str) -> Optional[str]:
+    """Like :func:`negotiate`, but ``None`` for bodies not worth compressing."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return None
+    return negotiate(accept_encoding)
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        # Fixed mtime so equal bodies compress to equal bytes
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
@@ -0,0 +1,122 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+# Directory shared by every worker on the host, e.g. /tmp/spotify-covers.
+# Unset keeps covers in memory only.
+IMAGE_DISK_CACHE_DIR = os.getenv("IMAGE_DISK_CACHE_DIR")
+IMAGE_DISK_CACHE_MAX_BYTES = int(
+    os.getenv("IMAGE_DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+logger = logging.getLogger("spotify-profile")
+
+
+class DiskImageCache:
+    """Image files on local disk, shared by all workers and kept across restarts.
+
+    Files are named after the SHA-1 of the URL (Spotify cover URLs are
+    themselves content hashes, so an entry never goes stale) and hold the
+    content type on the first line followed by the body. Writes go through a
+    temporary file and ``os.replace`` so readers never see partial files.
+    Reads refresh the file's mtime; once the writes of this process add up
+    to a tenth of ``max_bytes``, the least recently used files are removed
+    until the directory is back under 90% of ``max_bytes``.
+    """
+
+    def __init__(self, path: str, max_bytes: int = IMAGE_DISK_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url: str) -> str:
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, name[:2], name)
+
+    def get(self, url: str) -> Optional[Tuple[bytes, str]]:
+        path = self._file(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        content_type, sep, content = data.partition(b"\n")
+        if not sep or not content:
+            return None
+        return content, content_type.decode("latin-1")
+
+    def put(self, url: str, content: bytes, content_type: str) -> None:
+        path = self._file(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(content_type.encode("latin-1") + b"\n")
+                f.write(content)
+            os.replace(tmp, path)
+        except OSError:
+            logger.warning("could not write cover cache file %s", path)
+            return
+
+        with self._lock:
+            self._written += len(content)
+            if self._written < self.max_bytes // 10:
+                return
+            self._written = 0
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove least recently used files until under 90% of the cap."""
+        lock = None
+        if fcntl is not None:
+            lock = open(os.path.join(self.path, ".evict.lock"), "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another worker is already evicting
+                lock.close()
+                return
+        try:
+            files = []
+            total = 0
+            for bucket in os.scandir(self.path):
+                if not bucket.is_dir():
+                    continue
+                for entry in os.scandir(bucket.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            target = self.max_bytes * 0.9
+            if total <= target:
+                return
+            for _, size, path in sorted(files):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= target:
+                    break
+        finally:
+            if lock is not None:
+                lock.close()
+
+
+def create_disk_cache() -> Optional[DiskImageCache]:
+    if not IMAGE_DISK_CACHE_DIR:
+        return None
+    return DiskImageCache(IMAGE_DISK_CACHE_DIR)
@@ -1,17 +1,57 @@
 import json
 import os
+import threading
 from base64 import b64decode
 
 import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
 
+_db = None
+_db_lock = threading.Lock()
+
+
+def _create_client():
+    try:
+        app = firebase_admin.get_app()
+    except ValueError:
+        firebase_config = os.getenv("FIREBASE")
+        firebase_dict = json.loads(b64decode(firebase_config))
+
+        cred = credentials.Certificate(firebase_dict)
+        app = firebase_admin.initialize_app(cred)
+
+    return firestore.client(app)
+
 
 def get_firestore_db():
-    firebase_config = os.getenv("FIREBASE")
-    firebase_dict = json.loads(b64decode(firebase_config))
+    """Return the process-wide Firestore client, creating it on first use.
+
+    Credentials are parsed and the Firebase app initialized once per
+    process, and only when a request needs the database. Being lazy also
+    means each gunicorn worker opens its own gRPC channel after the fork.
+    """
+    global _db
+
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = _create_client()
+    return _db
+
+
+def warmup():
+    """Create the client ahead of the first request (e.g. in post_fork)."""
+    get_firestore_db()
+
 
-    cred = credentials.Certificate(firebase_dict)
-    firebase_admin.initialize_app(cred)
+def reset():
+    """Drop the client and Firebase app so the next call re-reads FIREBASE."""
+    global _db
 
-    return firestore.client()
+    with _db_lock:
+        _db = None
+        try:
+            firebase_admin.delete_app(firebase_admin.get_app())
+        except ValueError:
+            pass
@@ -0,0 +1,95 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from util.render_cache import fingerprint
+
+# Seconds a shared cache may serve a card past max-age while refetching it
+CACHE_STALE_WHILE_REVALIDATE = int(os.getenv("CACHE_STALE_WHILE_REVALIDATE", "30"))
+
+SVG_CONTENT_TYPE = "image/svg+xml; charset=utf-8"
+
+# Bump with any change to rendering code that alters the drawn cards (bar
+# CSS, thumbnails, palettes...); template edits are picked up on their own
+RENDER_VERSION = 1
+
+# (status, headers, body), turned into a response by each server
+Result = Tuple[int, Dict[str, str], bytes]
+
+
+def template_version(folder: str, *settings: Any) -> str:
+    """Fingerprint of what a card is drawn with, so ETags change with it.
+
+    Covers the templates in ``folder``, :data:`RENDER_VERSION` and the
+    configuration ``settings`` the caller renders with.
+    """
+    parts = []
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), "rb") as f:
+            parts.append((name, f.read()))
+    return fingerprint(RENDER_VERSION, settings, *parts)
+
+
+def etag(key: str) -> str:
+    """Weak ETag for a render fingerprint.
+
+    Weak because gzip and brotli bodies of a card share it.
+    """
+    return f'W/"{key}"'
+
+
+def is_not_modified(if_none_match: Optional[str], tag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = tag[2:] if tag.startswith("W/") else tag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def cache_control(
+    max_age: int, stale_while_revalidate: int = CACHE_STALE_WHILE_REVALIDATE
+) -> str:
+    value = f"public, max-age={max_age}"
+    if stale_while_revalidate:
+        value += f", stale-while-revalidate={stale_while_revalidate}"
+    return value
+
+
+def svg_headers(
+    tag: str, policy: str, encoding: Optional[str] = None
+) -> Dict[str, str]:
+    """Headers of an SVG card response, or of the 304 answering it."""
+    headers = {
+        "Content-Type": SVG_CONTENT_TYPE,
+        "Cache-Control": policy,
+        "ETag": tag,
+        "Vary": "Accept-Encoding",
+    }
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return headers
+
+
+def not_modified(
+    key: str, policy: str, if_none_match: Optional[str]
+) -> Optional[Result]:
+    """A 304 when the client already holds the card of ``key``, else ``None``.
+
+    Callers check this before rendering whenever the key is known up front.
+    """
+    tag = etag(key)
+    if is_not_modified(if_none_match, tag):
+        return 304, svg_headers(tag, policy), b""
+    return None
+
+
+def svg_result(
+    key: str, body: bytes, policy: str, encoding: Optional[str] = None
+) -> Result:
+    return 200, svg_headers(etag(key), policy, encoding), body
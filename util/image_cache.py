@@ -0,0 +1,65 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Total size of cached image bodies per process
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Cover URLs are content addressed, so entries rarely go stale
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", "3600"))
+
+Image = Tuple[bytes, str]
+
+
+class ImageCache:
+    """LRU cache of image bodies bounded by total bytes and a TTL.
+
+    Values are ``(content, content_type)``. Lookups, inserts and evictions
+    are O(1); only successful downloads should be stored.
+    """
+
+    def __init__(
+        self, max_bytes: int = IMAGE_CACHE_MAX_BYTES, ttl: int = IMAGE_CACHE_TTL
+    ):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._data: "OrderedDict[str, Tuple[float, Image]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Optional[Image]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(url)
+            if entry is None:
+                return None
+            expires_at, image = entry
+            if expires_at <= now:
+                self._pop(url)
+                return None
+            self._data.move_to_end(url)
+            return image
+
+    def put(self, url: str, content: bytes, content_type: str) -> None:
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(url)
+            self._data[url] = (time.time() + self.ttl, (content, content_type))
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, url: str) -> None:
+        entry = self._data.pop(url, None)
+        if entry is not None:
+            self.size -= len(entry[1][0])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
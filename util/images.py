@@ -1,47 +1,181 @@
+import asyncio
 import base64
-import time
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
+import httpx
 import requests
 
-DEFAULT_TIMEOUT = (3, 3)
-_TTL = 600  # 10 minutes
-_MAX_ENTRIES = 256
-_cache: Dict[str, Tuple[float, str]] = {}
+from util import singleflight
+from util.http_client import DEFAULT_TIMEOUT, get_async_client, get_session
+from util.disk_cache import create_disk_cache
+from util.image_cache import ImageCache
+from util.thumbnails import make_thumbnail, thumbnail_px
 
+# Shared by the card and recently-played endpoints, sync and async
+IMAGE_CACHE = ImageCache()
+# Optional second level shared by the workers of a host (IMAGE_DISK_CACHE_DIR)
+DISK_CACHE = create_disk_cache()
 
-def fetch_data_uri(url: str) -> str:
+_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str], "asyncio.Task"] = {}
+
+
+def _to_data_uri(data: bytes, content_type: str) -> str:
+    ctype = content_type.split(";")[0]
+    if not ctype.startswith("image/"):
+        ctype = "image/jpeg"
+    return f"data:{ctype};base64,{base64.b64encode(data).decode()}"
+
+
+def _download(url: str) -> Optional[Tuple[bytes, str]]:
+    for attempt in range(2):
+        try:
+            resp = get_session().get(url, timeout=DEFAULT_TIMEOUT)
+        except requests.RequestException:
+            return None
+        if resp.status_code >= 500 and attempt == 0:
+            continue
+        if resp.status_code != 200:
+            return None
+        return resp.content, resp.headers.get("Content-Type", "image/jpeg")
+    return None
+
+
+def _from_disk(url: str) -> Optional[Tuple[bytes, str]]:
+    image = DISK_CACHE.get(url) if DISK_CACHE else None
+    if image is not None:
+        IMAGE_CACHE.put(url, *image)
+    return image
+
+
+def _store(url: str, image: Tuple[bytes, str]) -> None:
+    IMAGE_CACHE.put(url, *image)
+    if DISK_CACHE:
+        DISK_CACHE.put(url, *image)
+
+
+def _thumbnail_key(url: str, size: int) -> str:
+    return f"{url}#{size}"
+
+
+def _thumbnail(url: str, image: Tuple[bytes, str], size: int) -> Tuple[bytes, str]:
+    content = make_thumbnail(image[0], thumbnail_px(size))
+    thumb = image if content is image[0] else (content, "image/jpeg")
+    IMAGE_CACHE.put(_thumbnail_key(url, size), *thumb)
+    return thumb
+
+
+def _load_original(url: str) -> Optional[Tuple[bytes, str]]:
+    image = IMAGE_CACHE.get(url)
+    if image is not None:
+        return image
+
+    def download():
+        # Another worker thread may have finished the download meanwhile
+        image = IMAGE_CACHE.get(url) or _from_disk(url)
+        if image is None:
+            image = _download(url)
+            if image is not None:
+                _store(url, image)
+        return image
+
+    # One lock file per cover URL would pile up: coalesce within the process
+    return singleflight.do(f"image:{url}", download, process_wide=False)
+
+
+def _load(url: str, size: Optional[int]) -> Optional[Tuple[bytes, str]]:
+    if size:
+        thumb = IMAGE_CACHE.get(_thumbnail_key(url, size))
+        if thumb is not None:
+            return thumb
+    image = _load_original(url)
+    if image is None or not size:
+        return image
+    return _thumbnail(url, image, size)
+
+
+def load_image(url: str, size: Optional[int] = None) -> bytes:
+    """Fetch raw image bytes through the shared cache; ``b""`` on failure.
+
+    With ``size`` (the CSS pixels the cover is drawn at) a downscaled JPEG
+    thumbnail is returned instead of the original.
+    """
+    if not url:
+        return b""
+    image = _load(url, size)
+    return image[0] if image else b""
+
+
+def fetch_data_uri(url: str, size: Optional[int] = None) -> str:
     """Fetch an image and return it as a data URI.
 
-    Uses a tiny in-memory cache with TTL to avoid refetching frequently.
-    Returns an empty string on failure.
+    Uses the shared image cache and, with ``size``, a thumbnail as in
+    :func:`load_image`. Returns an empty string on failure.
     """
 
     if not url:
         return ""
-    now = time.time()
-    cached = _cache.get(url)
-    if cached and cached[0] > now:
-        return cached[1]
+    image = _load(url, size)
+    return _to_data_uri(*image) if image else ""
+
 
+async def _download_async(url: str) -> Optional[Tuple[bytes, str]]:
+    # Small local files served from the page cache: not worth a thread
+    image = _from_disk(url)
+    if image is not None:
+        return image
     for attempt in range(2):
         try:
-            resp = requests.get(url, timeout=DEFAULT_TIMEOUT)
-        except requests.RequestException:
-            return ""
+            resp = await get_async_client().get(url)
+        except httpx.HTTPError:
+            return None
         if resp.status_code >= 500 and attempt == 0:
             continue
         if resp.status_code != 200:
-            return ""
-        data = resp.content
-        ctype = resp.headers.get("Content-Type", "image/jpeg").split(";")[0]
-        if not ctype.startswith("image/"):
-            ctype = "image/jpeg"
-        data_uri = f"data:{ctype};base64,{base64.b64encode(data).decode()}"
-        _cache[url] = (now + _TTL, data_uri)
-        if len(_cache) > _MAX_ENTRIES:
-            # Evict the oldest item
-            oldest = min(_cache.items(), key=lambda kv: kv[1][0])[0]
-            _cache.pop(oldest, None)
-        return data_uri
-    return ""
+            return None
+        image = resp.content, resp.headers.get("Content-Type", "image/jpeg")
+        _store(url, image)
+        return image
+    return None
+
+
+async def _load_original_async(url: str) -> Optional[Tuple[bytes, str]]:
+    image = IMAGE_CACHE.get(url)
+    if image is not None:
+        return image
+
+    key = (asyncio.get_running_loop(), url)
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_download_async(url))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # A cancelled waiter must not cancel the download shared with others
+    return await asyncio.shield(task)
+
+
+async def _load_async(url: str, size: Optional[int]) -> Optional[Tuple[bytes, str]]:
+    if size:
+        thumb = IMAGE_CACHE.get(_thumbnail_key(url, size))
+        if thumb is not None:
+            return thumb
+    image = await _load_original_async(url)
+    if image is None or not size:
+        return image
+    # Decoding and resampling is CPU bound, keep it off the event loop
+    return await asyncio.to_thread(_thumbnail, url, image, size)
+
+
+async def load_image_async(url: str, size: Optional[int] = None) -> bytes:
+    """asyncio variant of :func:`load_image`."""
+    if not url:
+        return b""
+    image = await _load_async(url, size)
+    return image[0] if image else b""
+
+
+async def fetch_data_uri_async(url: str, size: Optional[int] = None) -> str:
+    """asyncio variant of :func:`fetch_data_uri` sharing its cache."""
+    if not url:
+        return ""
+    image = await _load_async(url, size)
+    return _to_data_uri(*image) if image else ""
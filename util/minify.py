@@ -0,0 +1,55 @@
+import re
+from typing import Callable, Optional, Tuple
+
+from jinja2 import BaseLoader
+
+_COMMENT_RE = re.compile(r"\{#.*?#\}", re.S)
+_STYLE_RE = re.compile(r"(<style[^>]*>)(.*?)(</style>)", re.S)
+_TAG_RE = re.compile(r"(\{\{.*?\}\}|\{%.*?%\})", re.S)
+_CSS_PUNCT_RE = re.compile(r"\s*([{};:,>])\s*")
+
+
+def _minify_css(css: str) -> str:
+    parts = _TAG_RE.split(css)
+    # Odd parts are Jinja tags, kept verbatim. Whitespace next to them is
+    # kept as one newline so "{" never merges into "{{" or "{%".
+    for i in range(0, len(parts), 2):
+        text = parts[i]
+        compact = _CSS_PUNCT_RE.sub(r"\1", text).replace(";}", "}").strip()
+        if i > 0 and text[:1].isspace():
+            compact = "\n" + compact
+        if i < len(parts) - 1 and text[-1:].isspace():
+            compact += "\n"
+        parts[i] = compact
+    return "".join(parts)
+
+
+def minify_template(source: str) -> str:
+    """Strip template comments, indentation and blank lines, and compact CSS.
+
+    Only whitespace and the last semicolon of CSS blocks are removed; every
+    run of whitespace that could separate inline content is kept as a
+    newline, so templates render the same.
+    """
+    source = _COMMENT_RE.sub("", source)
+    lines = (line.strip() for line in source.splitlines())
+    source = "\n".join(line for line in lines if line)
+    return _STYLE_RE.sub(
+        lambda m: m.group(1) + _minify_css(m.group(2)) + m.group(3), source
+    )
+
+
+class MinifyingLoader(BaseLoader):
+    """Jinja loader minifying the sources of another loader once, at compile time."""
+
+    def __init__(self, loader: BaseLoader):
+        self.loader = loader
+
+    def get_source(
+        self, environment, template: str
+    ) -> Tuple[str, Optional[str], Optional[Callable[[], bool]]]:
+        source, filename, uptodate = self.loader.get_source(environment, template)
+        return minify_template(source), filename, uptodate
+
+    def list_templates(self):
+        return self.loader.list_templates()
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Seconds a now-playing answer is reused for the same uid. 0 disables it.
+NOW_PLAYING_TTL = float(os.getenv("NOW_PLAYING_TTL", "5"))
+NOW_PLAYING_MAX_ENTRIES = int(os.getenv("NOW_PLAYING_MAX_ENTRIES", "1024"))
+
+
+def _copy(data: Dict[str, Any]) -> Dict[str, Any]:
+    # Callers annotate the item, so never share the stored dicts
+    data = dict(data)
+    if data.get("item") is not None:
+        data["item"] = dict(data["item"])
+    return data
+
+
+class NowPlayingCache:
+    """Per-uid snapshot of the last now-playing response.
+
+    Camo and readers refreshing a profile ask for the same card many times a
+    second; within ``ttl`` they get the snapshot instead of a Spotify call.
+    ``progress_ms`` of a playing track is advanced by the time elapsed since
+    the snapshot, and a snapshot whose track would have ended is dropped.
+    An empty dict (nothing playing) is cached like any other answer.
+    """
+
+    def __init__(
+        self, ttl: float = NOW_PLAYING_TTL, max_entries: int = NOW_PLAYING_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: str, stale: bool = False) -> Optional[Dict[str, Any]]:
+        """Return the snapshot of ``uid`` as of now, or ``None`` on a miss.
+
+        ``stale=True`` ignores the TTL, for when Spotify cannot be asked;
+        a track that would have ended then reads as nothing playing.
+        """
+        if self.ttl <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(uid)
+            if entry is None:
+                return None
+            stored_at, data = entry
+            if now - stored_at >= self.ttl and not stale:
+                # Expired entries stay around for stale reads until evicted
+                return None
+            self._data.move_to_end(uid)
+
+        if not data:
+            return {}
+        snapshot = _copy(data)
+        progress_ms = snapshot.get("progress_ms")
+        if snapshot.get("is_playing") and progress_ms is not None:
+            progress_ms += int((now - stored_at) * 1000)
+            duration_ms = (snapshot.get("item") or {}).get("duration_ms")
+            if duration_ms and progress_ms >= duration_ms:
+                return {} if stale else None
+            snapshot["progress_ms"] = progress_ms
+        return snapshot
+
+    def set(self, uid: str, data: Optional[Dict[str, Any]]) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[uid] = (time.time(), _copy(data) if data else {})
+            self._data.move_to_end(uid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, uid: str) -> None:
+        with self._lock:
+            self._data.pop(uid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
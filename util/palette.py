@@ -0,0 +1,128 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import colorgram
+from PIL import Image, ImageFile
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+    np = None
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# Covers are shrunk to this many pixels per side before quantization
+PALETTE_SAMPLE_SIZE = int(os.getenv("PALETTE_SAMPLE_SIZE", "64"))
+PALETTE_CACHE_MAX_ENTRIES = int(os.getenv("PALETTE_CACHE_MAX_ENTRIES", "1024"))
+# "numpy" or "colorgram"; both return the same colors, numpy is much faster.
+# Falls back to colorgram when numpy is not installed.
+PALETTE_EXTRACTOR = os.getenv("PALETTE_EXTRACTOR", "numpy")
+
+RGB = Tuple[int, int, int]
+
+_cache: "OrderedDict[str, List[RGB]]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _key(content: bytes, count: int) -> str:
+    return f"{hashlib.sha1(content).hexdigest()}:{count}"
+
+
+def colorgram_palette(img: Image.Image, count: int) -> List[RGB]:
+    return [tuple(color.rgb) for color in colorgram.extract(img, count)]
+
+
+def numpy_palette(img: Image.Image, count: int) -> List[RGB]:
+    """Vectorized port of ``colorgram.extract`` with identical results.
+
+    Pixels are bucketed by the top two bits of their luminance, hue and
+    lightness (colorgram's 12-bit packing, bugs included); the ``count``
+    most populated buckets are returned as their mean color.
+    """
+    rgb = np.asarray(img.convert("RGB"), dtype=np.int64).reshape(-1, 3)
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    most = rgb.max(axis=1)
+    least = rgb.min(axis=1)
+    lightness = (most + least) >> 1
+
+    diff = most - least
+    safe_diff = np.where(diff == 0, 1, diff)
+    hue = np.where(
+        most == r,
+        (g - b) * 255 // safe_diff + np.where(g < b, 1530, 0),
+        np.where(
+            most == g,
+            (b - r) * 255 // safe_diff + 510,
+            (r - g) * 255 // safe_diff + 1020,
+        ),
+    )
+    hue = np.where(diff == 0, 0, hue // 6)
+    luminance = (r * 0.2126 + g * 0.7152 + b * 0.0722).astype(np.int64)
+
+    top_two_bits = 0b11000000
+    packed = (
+        ((luminance & top_two_bits) << 4)
+        | ((hue & top_two_bits) << 2)
+        | (lightness & top_two_bits)
+    )
+    counts = np.bincount(packed, minlength=4096)
+    used = np.flatnonzero(counts)
+    # Most populated first, ties in bucket order like colorgram's stable sort
+    used = used[np.lexsort((used, -counts[used]))][:count]
+    sums = [np.bincount(packed, weights=c, minlength=4096) for c in (r, g, b)]
+    return [tuple(int(channel[i]) // int(counts[i]) for channel in sums) for i in used]
+
+
+def _extractor():
+    if PALETTE_EXTRACTOR == "numpy" and np is not None:
+        return numpy_palette
+    return colorgram_palette
+
+
+def _extract(content: bytes, count: int) -> List[RGB]:
+    img = Image.open(io.BytesIO(content))
+    img.draft("RGB", (PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+    img = img.convert("RGB")
+    img.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+    return _extractor()(img, count)
+
+
+def _lookup(key: str) -> Optional[List[RGB]]:
+    with _cache_lock:
+        palette = _cache.get(key)
+        if palette is not None:
+            _cache.move_to_end(key)
+        return palette
+
+
+def cached_palette(content: bytes, count: int = 5) -> Optional[List[RGB]]:
+    """Return the memoized palette of ``content`` without computing it."""
+    return _lookup(_key(content, count))
+
+
+def extract_palette(content: bytes, count: int = 5) -> List[RGB]:
+    """Dominant colors of an image, most common first.
+
+    Memoized per image content, so a cover is decoded and quantized once
+    while it stays among the ``PALETTE_CACHE_MAX_ENTRIES`` most recent.
+    """
+    key = _key(content, count)
+    palette = _lookup(key)
+    if palette is not None:
+        return palette
+
+    palette = _extract(content, count)
+    with _cache_lock:
+        _cache[key] = palette
+        while len(_cache) > PALETTE_CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return palette
+
+
+def clear() -> None:
+    with _cache_lock:
+        _cache.clear()
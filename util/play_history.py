@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from util import singleflight, spotify
+
+# Plays kept per uid; also the page size asked from Spotify (its maximum is 50)
+PLAY_HISTORY_MAX_ITEMS = min(50, int(os.getenv("PLAY_HISTORY_MAX_ITEMS", "50")))
+# Seconds a uid's history is served without asking Spotify for new plays
+PLAY_HISTORY_REFRESH = float(os.getenv("PLAY_HISTORY_REFRESH", "15"))
+PLAY_HISTORY_MAX_UIDS = int(os.getenv("PLAY_HISTORY_MAX_UIDS", "1024"))
+
+
+def played_at_ms(item: Dict[str, Any]) -> Optional[int]:
+    """Return ``played_at`` of a play history item in Unix milliseconds."""
+    value = item.get("played_at")
+    if not value:
+        return None
+    try:
+        return int(
+            datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000
+        )
+    except ValueError:
+        return None
+
+
+def _slim(item: Dict[str, Any]) -> Dict[str, Any]:
+    # available_markets lists ~180 countries on both track and album
+    track = {k: v for k, v in item.get("track", {}).items() if k != "available_markets"}
+    if isinstance(track.get("album"), dict):
+        track["album"] = {
+            k: v for k, v in track["album"].items() if k != "available_markets"
+        }
+    return {**item, "track": track}
+
+
+class PlayHistory:
+    """Per-uid recently played list kept up to date with delta fetches.
+
+    The first fetch of a uid asks for the last ``max_items`` plays; later
+    fetches pass Spotify the ``after`` cursor of the newest stored play and
+    only prepend what is new, which is usually nothing. Within
+    ``refresh_interval`` seconds of the last fetch the list is served as is.
+    """
+
+    def __init__(
+        self,
+        max_items: int = PLAY_HISTORY_MAX_ITEMS,
+        refresh_interval: float = PLAY_HISTORY_REFRESH,
+        max_uids: int = PLAY_HISTORY_MAX_UIDS,
+    ):
+        self.max_items = max_items
+        self.refresh_interval = refresh_interval
+        self.max_uids = max_uids
+        # uid -> {"items", "cursor", "checked_at"}
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_fresh(self, uid: str) -> bool:
+        with self._lock:
+            entry = self._data.get(uid)
+            return (
+                entry is not None
+                and time.time() - entry["checked_at"] < self.refresh_interval
+            )
+
+    def has(self, uid: str) -> bool:
+        with self._lock:
+            return uid in self._data
+
+    def fetch_kwargs(self, uid: str) -> Dict[str, Any]:
+        """Keyword arguments for ``get_recently_played`` fetching the delta."""
+        with self._lock:
+            entry = self._data.get(uid)
+            cursor = entry["cursor"] if entry else None
+        if cursor is None:
+            return {"limit": self.max_items}
+        return {"limit": self.max_items, "after": cursor}
+
+    def update(
+        self, uid: str, data: Optional[Dict[str, Any]], after: Optional[int] = None
+    ) -> None:
+        """Store a response fetched with ``fetch_kwargs(uid)``."""
+        new_items = [_slim(item) for item in (data or {}).get("items", [])]
+        with self._lock:
+            entry = self._data.get(uid)
+            if after is None or entry is None:
+                items = new_items
+            else:
+                seen = {
+                    (item.get("played_at"), item["track"].get("id"))
+                    for item in entry["items"]
+                }
+                fresh = [
+                    item
+                    for item in new_items
+                    if (item.get("played_at"), item["track"].get("id")) not in seen
+                ]
+                items = fresh + entry["items"]
+            items.sort(key=lambda item: played_at_ms(item) or 0, reverse=True)
+            items = items[: self.max_items]
+
+            cursor = max(filter(None, map(played_at_ms, items)), default=None)
+            if after is not None and len(new_items) >= self.max_items:
+                # A full delta page may hide a gap: start over next time
+                cursor = None
+            self._data[uid] = {
+                "items": items,
+                "cursor": cursor,
+                "checked_at": time.time(),
+            }
+            self._data.move_to_end(uid)
+            while len(self._data) > self.max_uids:
+                self._data.popitem(last=False)
+
+    def items(self, uid: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return the newest ``limit`` plays of ``uid``, newest first."""
+        with self._lock:
+            entry = self._data.get(uid)
+            items = entry["items"][:limit] if entry else []
+        # Callers annotate the track, so never hand out the stored dicts
+        return [{**item, "track": dict(item["track"])} for item in items]
+
+    def refresh(
+        self, uid: str, fetch: Callable[..., Optional[Dict[str, Any]]]
+    ) -> List[Dict[str, Any]]:
+        """Bring the history of ``uid`` up to date and return it.
+
+        ``fetch(**kwargs)`` calls ``spotify.get_recently_played``; concurrent
+        refreshes of the same uid share one call. While Spotify is rate
+        limited or the uid is over quota, the stored history is served as is;
+        the error is raised only when there is none.
+        """
+        if not self.is_fresh(uid):
+
+            def run():
+                if self.is_fresh(uid):
+                    return
+                kwargs = self.fetch_kwargs(uid)
+                self.update(uid, fetch(**kwargs), kwargs.get("after"))
+
+            try:
+                # The history lives in this process; other workers keep theirs
+                singleflight.do(f"history:{uid}", run, process_wide=False)
+            except spotify.RateLimitError:
+                if not self.has(uid):
+                    raise
+        return self.items(uid)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+PLAY_HISTORY = PlayHistory()
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Spotify API calls per second for the whole deployment (one client ID).
+# 0 disables the scheduler.
+SPOTIFY_QUOTA_RATE = float(os.getenv("SPOTIFY_QUOTA_RATE", "0"))
+# Calls that may be made at once after an idle period
+SPOTIFY_QUOTA_BURST = float(
+    os.getenv("SPOTIFY_QUOTA_BURST", str(SPOTIFY_QUOTA_RATE * 2))
+)
+# Share of the burst kept for calls whose answer is shown on a card
+SPOTIFY_QUOTA_RESERVE = float(os.getenv("SPOTIFY_QUOTA_RESERVE", "0.25"))
+# A uid counts towards the fair share for this many seconds after a call
+SPOTIFY_QUOTA_WINDOW = float(os.getenv("SPOTIFY_QUOTA_WINDOW", "60"))
+# Worker processes sharing the budget (gunicorn also reads this variable)
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+
+
+class QuotaScheduler:
+    """Token bucket splitting one API budget fairly across uids.
+
+    A global bucket refills at ``rate`` calls per second. Each uid seen in
+    the last ``window`` seconds also has its own bucket refilling at an
+    equal share of ``rate``, so one popular profile cannot drain the budget
+    of everyone else. Speculative calls (results that may not be shown) only
+    run while more than ``reserve`` of the global burst is left.
+    """
+
+    def __init__(
+        self,
+        rate: float = SPOTIFY_QUOTA_RATE / WEB_CONCURRENCY,
+        burst: float = SPOTIFY_QUOTA_BURST / WEB_CONCURRENCY,
+        reserve: float = SPOTIFY_QUOTA_RESERVE,
+        window: float = SPOTIFY_QUOTA_WINDOW,
+    ):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.reserve = reserve
+        self.window = window
+        self._tokens = self.burst
+        self._updated_at = time.time()
+        # uid -> [tokens, updated_at], least recently used first
+        self._uids: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _expire(self, now: float) -> None:
+        while self._uids:
+            uid, (_, seen_at) = next(iter(self._uids.items()))
+            if now - seen_at < self.window:
+                break
+            del self._uids[uid]
+
+    def try_acquire(self, uid: str, speculative: bool = False) -> bool:
+        """Take one call from the budget of ``uid``; ``False`` if over it."""
+        if not self.enabled:
+            return True
+        now = time.time()
+        with self._lock:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            floor = self.burst * self.reserve if speculative else 0.0
+            if self._tokens - 1 < floor:
+                return False
+
+            self._expire(now)
+            active = len(self._uids) + (uid not in self._uids)
+            share = self.rate / active
+            capacity = max(1.0, self.burst / active)
+            tokens, seen_at = self._uids.pop(uid, (capacity, now))
+            tokens = min(capacity, tokens + (now - seen_at) * share)
+            self._uids[uid] = [tokens, now]
+            if tokens < 1:
+                return False
+
+            self._uids[uid][0] = tokens - 1
+            self._tokens -= 1
+            return True
+
+    def active_uids(self) -> int:
+        with self._lock:
+            self._expire(time.time())
+            return len(self._uids)
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Union
+
+# Total size of rendered cards kept per process (they embed the cover)
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+# Granularity of the apple theme progress bar; progress is rounded down to it
+RENDER_PROGRESS_BUCKET_MS = int(os.getenv("RENDER_PROGRESS_BUCKET_MS", "1000"))
+
+
+def fingerprint(*parts: Any) -> str:
+    """Stable digest of ``parts``, identical across processes and restarts."""
+    canonical = "\x1f".join(repr(part) for part in parts)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def bucket_progress(progress_ms: Optional[int]) -> Optional[int]:
+    if not progress_ms or RENDER_PROGRESS_BUCKET_MS <= 1:
+        return progress_ms
+    return progress_ms - progress_ms % RENDER_PROGRESS_BUCKET_MS
+
+
+class RenderCache:
+    """LRU cache of rendered cards keyed by :func:`fingerprint`.
+
+    A fingerprint covers everything drawn on the card, so entries never go
+    stale. Compressed bodies are kept next to the card they encode; memory
+    is bounded by the total size of both.
+    """
+
+    def __init__(self, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: "OrderedDict[str, Dict[str, Union[str, bytes]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._get(key, "svg")
+
+    def get_body(self, key: str, encoding: str) -> Optional[bytes]:
+        """The card of ``key`` compressed with ``encoding``, if stored."""
+        return self._get(key, encoding)
+
+    def _get(self, key: str, field: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry.get(field)
+
+    def put(self, key: str, svg: str) -> None:
+        if len(svg) > self.max_bytes:
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = {"svg": svg}
+            self.size += len(svg)
+            self._evict()
+
+    def put_body(self, key: str, encoding: str, body: bytes) -> None:
+        """Store a compressed body for a card that is still cached."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or encoding in entry:
+                return
+            entry[encoding] = body
+            self.size += len(body)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._data)))
+
+    def _pop(self, key: str) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= sum(len(value) for value in entry.values())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
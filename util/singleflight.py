@@ -0,0 +1,77 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX platforms
+    fcntl = None
+
+# Directory for per-key lock files shared by every worker on the host.
+# Unset limits coalescing to the threads of a single process.
+SINGLEFLIGHT_LOCK_DIR = os.getenv("SINGLEFLIGHT_LOCK_DIR")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+_calls: Dict[str, _Call] = {}
+_calls_lock = threading.Lock()
+
+
+@contextmanager
+def _process_lock(key: str):
+    if not SINGLEFLIGHT_LOCK_DIR or fcntl is None:
+        yield
+        return
+    os.makedirs(SINGLEFLIGHT_LOCK_DIR, exist_ok=True)
+    name = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".lock"
+    with open(os.path.join(SINGLEFLIGHT_LOCK_DIR, name), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def do(key: str, fn: Callable[[], Any], process_wide: bool = True) -> Any:
+    """Run ``fn`` once for all concurrent callers of the same ``key``.
+
+    The first caller runs ``fn``; callers arriving while it runs wait and get
+    the same result or exception. With ``SINGLEFLIGHT_LOCK_DIR`` set, leaders
+    in other workers are serialized by a file lock, so ``fn`` should re-check
+    shared state before doing the expensive work. ``process_wide=False``
+    skips the file lock for keys that are too many to keep a lock file each.
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            call = _calls[key] = _Call()
+
+    if not is_leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        if process_wide:
+            with _process_lock(key):
+                call.result = fn()
+        else:
+            call.result = fn()
+    except BaseException as exc:
+        call.error = exc
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
+    return call.result
@@ -8,7 +8,9 @@ import json
 import os
 import random
 
-DEFAULT_TIMEOUT = (3, 3)
+from util.circuit_breaker import CircuitBreaker, parse_retry_after
+from util.http_client import DEFAULT_TIMEOUT, get_session
+from util.quota import QuotaScheduler
 
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_SECRET_ID = os.getenv("SPOTIFY_SECRET_ID")
@@ -29,12 +31,41 @@ class InvalidTokenError(Exception):
 
 
 class RateLimitError(Exception):
-    pass
+    def __init__(self, message="rate limited", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(RateLimitError):
+    """Raised without calling Spotify while the client is backing off."""
+
+
+class QuotaExceededError(RateLimitError):
+    """Raised when a uid is over its share of the deployment's API budget."""
 
 
 class SpotifyTimeoutError(Exception):
     pass
 
+
+class SpotifyServerError(Exception):
+    """Raised when Spotify answers with a 5xx status."""
+
+
+# Spotify is out of reach for now; a stored snapshot can stand in
+UNAVAILABLE_ERRORS = (RateLimitError, SpotifyTimeoutError, SpotifyServerError)
+
+
+def raise_for_status(response):
+    if response.status_code >= 500:
+        raise SpotifyServerError(f"Spotify error {response.status_code}")
+    response.raise_for_status()
+
+
+# Every user shares one client ID, so back-off and budget apply to all of them
+BREAKER = CircuitBreaker()
+QUOTA = QuotaScheduler()
+
 def get_authorization():
 
     return b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_SECRET_ID}".encode()).decode(
@@ -51,7 +82,9 @@ def generate_token(authorization_code):
 
     headers = {"Authorization": f"Basic {get_authorization()}"}
 
-    response = requests.post(SPOTIFY_URL_GENERATE_TOKEN, data=data, headers=headers)
+    response = get_session().post(
+        SPOTIFY_URL_GENERATE_TOKEN, data=data, headers=headers, timeout=DEFAULT_TIMEOUT
+    )
     response_json = response.json()
 
     return response_json
@@ -65,7 +98,9 @@ def refresh_token(refresh_token):
 
     headers = {"Authorization": f"Basic {get_authorization()}"}
 
-    response = requests.post(SPOTIFY_URL_REFRESH_TOKEN, data=data, headers=headers)
+    response = get_session().post(
+        SPOTIFY_URL_REFRESH_TOKEN, data=data, headers=headers, timeout=DEFAULT_TIMEOUT
+    )
     response_json = response.json()
 
     return response_json
@@ -74,16 +109,52 @@ def get_user_profile(access_token):
 
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    response = requests.get(SPOTIFY_URL_USER_INFO, headers=headers)
+    response = get_session().get(
+        SPOTIFY_URL_USER_INFO, headers=headers, timeout=DEFAULT_TIMEOUT
+    )
     response_json = response.json()
 
     return response_json
 
+def acquire_quota(uid, speculative=False):
+    """Spend one API call of ``uid``'s budget or raise QuotaExceededError.
+
+    Pass ``speculative=True`` for calls whose result may not be shown.
+    """
+    if not QUOTA.try_acquire(uid, speculative):
+        raise QuotaExceededError("over Spotify API budget")
+
+
+def check_breaker():
+    wait = BREAKER.wait_time()
+    if wait > 0:
+        raise CircuitOpenError("Spotify API backing off", retry_after=wait)
+
+
+def record_response(response):
+    """Feed a Spotify API response to the breaker; raise on 429."""
+    if response.status_code == 429:
+        retry_after = BREAKER.record_rate_limit(
+            parse_retry_after(response.headers.get("Retry-After"))
+        )
+        raise RateLimitError("rate limited", retry_after=retry_after)
+    if response.status_code >= 500:
+        BREAKER.record_failure()
+    else:
+        BREAKER.record_success()
+
+
 def _request_with_retry(url, headers, params=None, retries=1):
     for attempt in range(retries + 1):
-        response = requests.get(
-            url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT
-        )
+        check_breaker()
+        try:
+            response = get_session().get(
+                url, headers=headers, params=params, timeout=DEFAULT_TIMEOUT
+            )
+        except requests.Timeout as exc:
+            BREAKER.record_failure()
+            raise SpotifyTimeoutError("request timeout") from exc
+        record_response(response)
         if response.status_code >= 500 and attempt < retries:
             continue
         return response
@@ -96,31 +167,33 @@ def smallest_image(images):
     return images[-1].get("url", "") or images[0].get("url", "")
 
 
-def get_recently_played(access_token, limit=5):
+def get_recently_played(access_token, limit=5, after=None):
+    """Fetch the last plays; with ``after`` (Unix ms) only newer ones."""
     headers = {"Authorization": f"Bearer {access_token}"}
-    try:
-        response = _request_with_retry(
-            SPOTIFY_URL_RECENTLY_PLAY, headers, params={"limit": limit}, retries=1
-        )
-    except requests.Timeout as exc:  # pragma: no cover - network timeout
-        raise SpotifyTimeoutError("request timeout") from exc
+    params = {"limit": limit}
+    if after is not None:
+        params["after"] = after
+    response = _request_with_retry(
+        SPOTIFY_URL_RECENTLY_PLAY, headers, params=params, retries=1
+    )
     if response.status_code == 204:
         return {}
     if response.status_code == 401:
         raise InvalidTokenError("invalid or expired token")
-    if response.status_code == 429:
-        raise RateLimitError("rate limited")
-    response.raise_for_status()
+    raise_for_status(response)
     return response.json()
 
 def get_now_playing(access_token):
 
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    response = requests.get(SPOTIFY_URL_NOW_PLAYING, headers=headers)
+    response = _request_with_retry(SPOTIFY_URL_NOW_PLAYING, headers, retries=0)
 
     if response.status_code == 204:
         return {}
+    if response.status_code == 401:
+        raise InvalidTokenError("invalid or expired token")
+    raise_for_status(response)
 
     response_json = response.json()
     return response_json
@@ -0,0 +1,64 @@
+"""asyncio variants of the util.spotify calls used to render cards.
+
+They share URLs, credentials and exceptions with util.spotify, so callers
+handle errors the same way in the sync and async pipelines.
+"""
+
+from typing import Any, Dict, Optional
+
+import httpx
+
+from util.http_client import get_async_client
+from util.spotify import (
+    SPOTIFY_URL_NOW_PLAYING,
+    SPOTIFY_URL_RECENTLY_PLAY,
+    BREAKER,
+    InvalidTokenError,
+    SpotifyTimeoutError,
+    check_breaker,
+    raise_for_status,
+    record_response,
+)
+
+
+async def _request_with_retry(url, headers, params=None, retries=1):
+    for attempt in range(retries + 1):
+        check_breaker()
+        try:
+            response = await get_async_client().get(url, headers=headers, params=params)
+        except httpx.TimeoutException as exc:  # pragma: no cover - network timeout
+            BREAKER.record_failure()
+            raise SpotifyTimeoutError("request timeout") from exc
+        record_response(response)
+        if response.status_code >= 500 and attempt < retries:
+            continue
+        return response
+
+
+async def get_recently_played(
+    access_token: str, limit: int = 5, after: Optional[int] = None
+) -> Dict[str, Any]:
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"limit": limit}
+    if after is not None:
+        params["after"] = after
+    response = await _request_with_retry(
+        SPOTIFY_URL_RECENTLY_PLAY, headers, params=params, retries=1
+    )
+    if response.status_code == 204:
+        return {}
+    if response.status_code == 401:
+        raise InvalidTokenError("invalid or expired token")
+    raise_for_status(response)
+    return response.json()
+
+
+async def get_now_playing(access_token: str) -> Dict[str, Any]:
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = await _request_with_retry(SPOTIFY_URL_NOW_PLAYING, headers, retries=0)
+    if response.status_code == 204:
+        return {}
+    if response.status_code == 401:
+        raise InvalidTokenError("invalid or expired token")
+    raise_for_status(response)
+    return response.json()
@@ -0,0 +1,91 @@
+import re
+from typing import Dict, List, Mapping, Tuple
+
+# Marks a per-request value in a pre-rendered skeleton; never produced by
+# the templates themselves.
+_SLOT = "\x00{}\x00"
+_SLOT_RE = re.compile("\x00(\\w+)\x00")
+
+Skeleton = Tuple[str, ...]
+
+
+class Theme:
+    """Layout metadata of a now-playing card theme."""
+
+    def __init__(
+        self,
+        name: str,
+        height: int = 145,
+        cover_height: int = 445,
+        num_bar: int = 75,
+        cover_size: int = 300,
+        progress: bool = False,
+    ):
+        self.name = name
+        self.template = f"spotify.{name}.html.j2"
+        self.height = height
+        # Height of the card when the cover image is shown
+        self.cover_height = cover_height
+        self.num_bar = num_bar
+        # CSS pixels the cover is drawn at
+        self.cover_size = cover_size
+        # Draws the playback progress bar
+        self.progress = progress
+        # Bars are 3px wide with a 1px gap; the durations come from css_bar
+        self.content_bar = "".join(
+            f"<div class='bar' style='left:{1 + 4 * i}px'></div>"
+            for i in range(num_bar)
+        )
+
+    def card_height(self, cover_image: bool) -> int:
+        return self.cover_height if cover_image else self.height
+
+
+THEMES: Dict[str, Theme] = {
+    theme.name: theme
+    for theme in (
+        Theme("default"),
+        Theme("compact", height=100, cover_height=400),
+        Theme("karaoke"),
+        Theme("natemoo-re", height=84, cover_height=84, num_bar=100, cover_size=64),
+        Theme("novatorem", height=100, cover_height=100, num_bar=100, cover_size=80),
+        Theme(
+            "apple",
+            height=534,
+            cover_height=534,
+            num_bar=0,
+            cover_size=288,
+            progress=True,
+        ),
+    )
+}
+
+
+def theme_name(name: str) -> str:
+    """``name`` if it is a registered theme, else ``"default"``."""
+    return name if name in THEMES else "default"
+
+
+def get_theme(name: str) -> Theme:
+    """Registered theme ``name``; raises ``KeyError`` for unknown names."""
+    return THEMES[name]
+
+
+def slot(name: str) -> str:
+    return _SLOT.format(name)
+
+
+def split_skeleton(rendered: str) -> Skeleton:
+    """Split a template rendered with :func:`slot` values into its parts.
+
+    The result alternates static markup and slot names, starting and ending
+    with static markup.
+    """
+    return tuple(_SLOT_RE.split(rendered))
+
+
+def fill_skeleton(skeleton: Skeleton, values: Mapping[str, str]) -> str:
+    parts: List[str] = list(skeleton)
+    for i in range(1, len(parts), 2):
+        parts[i] = str(values[parts[i]])
+    return "".join(parts)
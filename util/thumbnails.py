@@ -0,0 +1,38 @@
+import io
+import os
+
+from PIL import Image, ImageFile
+
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# JPEG quality of re-encoded covers
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+# Pixels per drawn CSS pixel; 2 keeps covers sharp on HiDPI screens
+THUMBNAIL_SCALE = float(os.getenv("THUMBNAIL_SCALE", "1"))
+
+
+def thumbnail_px(size: int) -> int:
+    """Pixel size of the thumbnail for a cover drawn at ``size`` CSS pixels."""
+    return max(1, round(size * THUMBNAIL_SCALE))
+
+
+def make_thumbnail(content: bytes, px: int, quality: int = THUMBNAIL_QUALITY) -> bytes:
+    """Downscale ``content`` to fit ``px`` x ``px`` and re-encode it as JPEG.
+
+    Returns ``content`` unchanged when it is already small enough, cannot be
+    decoded, or would not get smaller.
+    """
+    try:
+        img = Image.open(io.BytesIO(content))
+        if max(img.size) <= px:
+            return content
+        # Let the JPEG decoder skip detail we are about to throw away
+        img.draft("RGB", (px, px))
+        img = img.convert("RGB")
+        img.thumbnail((px, px), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=quality)
+    except (OSError, ValueError):
+        return content
+    thumb = out.getvalue()
+    return thumb if len(thumb) < len(content) else content
@@ -0,0 +1,186 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "1024"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "3600"))
+# Path of a SQLite file shared by every worker on the host, e.g.
+# /tmp/spotify-token-cache.sqlite3. Unset keeps the cache per process.
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH")
+# Seconds between LRU updates of an entry, so most hits only read the file
+TOKEN_CACHE_TOUCH_INTERVAL = 30
+
+logger = logging.getLogger("spotify-profile")
+
+
+class MemoryTokenCache:
+    """Per-process LRU cache with a TTL and an entry limit."""
+
+    def __init__(
+        self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, ttl: int = TOKEN_CACHE_TTL
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(uid)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if now - stored_at >= self.ttl:
+                del self._data[uid]
+                return None
+            self._data.move_to_end(uid)
+            return dict(value)
+
+    def set(self, uid: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._data[uid] = (time.time(), dict(value))
+            self._data.move_to_end(uid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, uid: str) -> None:
+        with self._lock:
+            self._data.pop(uid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTokenCache:
+    """LRU cache stored in a SQLite file so all workers on a host share it.
+
+    One Firestore read by any worker warms the cache for the others. Each
+    thread keeps its own connection; WAL mode lets readers run alongside a
+    writer. The file holds refresh tokens, so only its owner may read it.
+    Lock timeouts and other SQLite errors are logged; reads then miss and
+    writes are skipped.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = TOKEN_CACHE_MAX_ENTRIES,
+        ttl: int = TOKEN_CACHE_TTL,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection must not cross a fork (gunicorn workers)
+        if conn is None or self._local.pid != os.getpid():
+            self._create_private()
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_cache ("
+                "uid TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS token_cache_accessed "
+                "ON token_cache (accessed_at)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_private(self) -> None:
+        # SQLite gives the -wal and -shm files the mode of the database file
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self._get(uid)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("token cache read failed: %s", e)
+            return None
+
+    def _get(self, uid: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT value, stored_at, accessed_at FROM token_cache WHERE uid = ?",
+            (uid,),
+        ).fetchone()
+        if row is None:
+            return None
+        value, stored_at, accessed_at = row
+        if now - stored_at >= self.ttl:
+            conn.execute("DELETE FROM token_cache WHERE uid = ?", (uid,))
+            return None
+        if now - accessed_at >= TOKEN_CACHE_TOUCH_INTERVAL:
+            conn.execute(
+                "UPDATE token_cache SET accessed_at = ? WHERE uid = ?", (now, uid)
+            )
+        return json.loads(value)
+
+    def set(self, uid: str, value: Dict[str, Any]) -> None:
+        try:
+            self._set(uid, value)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("token cache write failed: %s", e)
+
+    def _set(self, uid: str, value: Dict[str, Any]) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO token_cache (uid, value, stored_at, accessed_at) "
+            "VALUES (?, ?, ?, ?)",
+            (uid, json.dumps(value, default=str), now, now),
+        )
+        conn.execute(
+            "DELETE FROM token_cache WHERE uid IN ("
+            "SELECT uid FROM token_cache ORDER BY accessed_at DESC "
+            "LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def delete(self, uid: str) -> None:
+        try:
+            self._conn().execute("DELETE FROM token_cache WHERE uid = ?", (uid,))
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("token cache delete failed: %s", e)
+
+    def clear(self) -> None:
+        try:
+            self._conn().execute("DELETE FROM token_cache")
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("token cache clear failed: %s", e)
+
+    def __len__(self) -> int:
+        try:
+            conn = self._conn()
+            return conn.execute("SELECT COUNT(*) FROM token_cache").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            logger.warning("token cache count failed: %s", e)
+            return 0
+
+
+def create_token_cache():
+    """Return the token cache configured by the environment."""
+    if TOKEN_CACHE_PATH:
+        return SQLiteTokenCache(TOKEN_CACHE_PATH)
+    return MemoryTokenCache()
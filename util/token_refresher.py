@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+# Opt-in because serverless platforms freeze the process between requests
+TOKEN_REFRESHER_ENABLED = os.getenv("TOKEN_REFRESHER", "false") == "true"
+# Refresh tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "300"))
+TOKEN_REFRESH_INTERVAL = int(os.getenv("TOKEN_REFRESH_INTERVAL", "30"))
+# Only uids requested within this window are kept fresh
+TOKEN_ACTIVE_WINDOW = int(os.getenv("TOKEN_ACTIVE_WINDOW", "3600"))
+TOKEN_ACTIVE_MAX = int(os.getenv("TOKEN_ACTIVE_MAX", "1024"))
+
+logger = logging.getLogger("spotify-profile")
+
+
+class TokenRefresher:
+    """Refresh the tokens of recently active uids ahead of their expiry.
+
+    ``get_token_info(uid)`` returns the cached token dict (or ``None``) and
+    ``refresh(uid, token_info)`` performs the refresh; both are supplied by
+    the endpoint so the refresher shares its cache and single-flight lock.
+    """
+
+    def __init__(
+        self,
+        get_token_info: Callable[[str], Optional[Dict[str, Any]]],
+        refresh: Callable[[str, Dict[str, Any]], Any],
+        margin: int = TOKEN_REFRESH_MARGIN,
+        interval: int = TOKEN_REFRESH_INTERVAL,
+        active_window: int = TOKEN_ACTIVE_WINDOW,
+        max_active: int = TOKEN_ACTIVE_MAX,
+    ):
+        self.get_token_info = get_token_info
+        self.refresh = refresh
+        self.margin = margin
+        self.interval = interval
+        self.active_window = active_window
+        self.max_active = max_active
+        self._active: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+
+    def touch(self, uid: str) -> None:
+        """Record that ``uid`` was just requested."""
+        with self._lock:
+            self._active[uid] = time.time()
+            self._active.move_to_end(uid)
+            while len(self._active) > self.max_active:
+                self._active.popitem(last=False)
+
+    def active_uids(self) -> List[str]:
+        cutoff = time.time() - self.active_window
+        with self._lock:
+            while self._active:
+                uid, last_seen = next(iter(self._active.items()))
+                if last_seen >= cutoff:
+                    break
+                self._active.popitem(last=False)
+            return list(self._active)
+
+    def run_once(self) -> int:
+        """Refresh every active token expiring within the margin."""
+        refreshed = 0
+        deadline = int(time.time()) + self.margin
+        for uid in self.active_uids():
+            token_info = self.get_token_info(uid)
+            if not token_info or "refresh_token" not in token_info:
+                continue
+            expired_ts = token_info.get("expired_ts")
+            if expired_ts is not None and expired_ts > deadline:
+                continue
+            try:
+                self.refresh(uid, token_info)
+                refreshed += 1
+            except Exception:  # noqa: BLE001
+                logger.exception("background token refresh failed: %s", uid)
+        return refreshed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self) -> None:
+        """Start the background thread once per process (safe after fork)."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="token-refresher", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from util import singleflight, spotify
+from util.firestore import get_firestore_db
+from util.token_cache import create_token_cache
+from util.write_behind import create_write_behind_queue
+
+# Refresh a little before Spotify's expiry so in-flight calls don't fail
+TOKEN_EXPIRY_LEEWAY = 30
+# Expiry field written before the schema was unified (recently-played)
+LEGACY_EXPIRY_FIELD = "token_expired_timestamp"
+
+logger = logging.getLogger("spotify-profile")
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def normalize_token_info(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return ``data`` in the canonical schema.
+
+    The canonical document holds ``access_token``, ``refresh_token`` and
+    ``expired_ts`` (unix seconds). Documents written by the old
+    recently-played endpoint carry ``token_expired_timestamp`` instead;
+    when both exist the later expiry belongs to the latest access token.
+    """
+    info = dict(data)
+    legacy = info.pop(LEGACY_EXPIRY_FIELD, None)
+    if legacy is not None:
+        info["expired_ts"] = max(int(info.get("expired_ts") or 0), int(legacy))
+    return info
+
+
+def is_expired(token_info: Dict[str, Any], now: Optional[int] = None) -> bool:
+    if now is None:
+        now = int(time.time())
+    expired_ts = token_info.get("expired_ts")
+    return expired_ts is None or now >= int(expired_ts) - TOKEN_EXPIRY_LEEWAY
+
+
+class TokenStore:
+    """Spotify tokens per uid: cache in front of the Firestore users collection.
+
+    ``get_db`` is called only when Firestore is actually needed. Every
+    endpoint reads and writes the same canonical document, so a token
+    refreshed by one endpoint is reused by the others. With a write-behind
+    queue, refreshed tokens reach Firestore on the next flush and pending
+    updates override what Firestore returns until then.
+    """
+
+    def __init__(self, get_db: Callable[[], Any], cache=None, writer=None):
+        self.get_db = get_db
+        self.cache = cache if cache is not None else create_token_cache()
+        self.writer = (
+            writer if writer is not None else create_write_behind_queue(get_db)
+        )
+
+    def _doc(self, uid: str):
+        return self.get_db().collection("users").document(uid)
+
+    def _load(self, uid: str) -> Optional[Dict[str, Any]]:
+        doc = self._doc(uid).get()
+        if not doc.exists:
+            logger.info("not exist data in firebase: %s", uid)
+            return None
+        token_info = normalize_token_info(doc.to_dict())
+        pending = self.writer.pending(uid) if self.writer else None
+        if pending:
+            token_info.update(pending)
+        self.cache.set(uid, token_info)
+        return token_info
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        """Return the token info of ``uid`` from the cache or Firestore."""
+        token_info = self.cache.get(uid)
+        if token_info is None:
+            token_info = self._load(uid)
+        return token_info
+
+    def cached_access_token(self, uid: str) -> Optional[str]:
+        """Return a valid token from the cache only, without any I/O."""
+        token_info = self.cache.get(uid)
+        if token_info is None or is_expired(token_info):
+            return None
+        return token_info.get("access_token")
+
+    def get_access_token(self, uid: str) -> Optional[str]:
+        """Return a valid access token, refreshing it when expired.
+
+        Returns ``None`` when the user is unknown or revoked access.
+        """
+        token_info = self.get(uid)
+        if token_info is None:
+            return None
+        if is_expired(token_info):
+            return self.refresh(uid, token_info)
+        return token_info.get("access_token")
+
+    def refresh(self, uid: str, token_info: Optional[Dict[str, Any]] = None):
+        """Refresh the access token of ``uid`` once for all concurrent callers.
+
+        ``token_info`` is the token the caller found stale; if another thread
+        or worker has already replaced it, that newer token is returned.
+        """
+        if token_info is None:
+            token_info = self.get(uid)
+            if token_info is None:
+                return None
+        stale_token = token_info.get("access_token")
+        return singleflight.do(
+            f"token:{uid}", lambda: self._refresh(uid, token_info, stale_token)
+        )
+
+    def _refresh(
+        self, uid: str, token_info: Dict[str, Any], stale_token: Optional[str]
+    ) -> Optional[str]:
+        # Another thread or worker may have stored a new token while we waited
+        latest = self.cache.get(uid)
+        if latest is None or latest.get("access_token") == stale_token:
+            latest = self._load(uid)
+            if latest is None:
+                self.cache.delete(uid)
+                return None
+        if latest.get("access_token") != stale_token and not is_expired(latest):
+            return latest["access_token"]
+        token_info = dict(token_info, **latest)
+
+        new_token = spotify.refresh_token(token_info["refresh_token"])
+
+        # Handle refresh token revoke
+        if new_token.get("error") == "invalid_grant":
+            self.delete(uid)
+            return None
+
+        update_data = {
+            "access_token": new_token["access_token"],
+            "expired_ts": int(time.time()) + int(new_token.get("expires_in", 3600)),
+        }
+        self.cache.set(uid, dict(token_info, **update_data))
+        if self.writer:
+            self.writer.put(uid, update_data)
+        else:
+            self._doc(uid).set(update_data, merge=True)
+        return new_token["access_token"]
+
+    def save(self, uid: str, token_info: Dict[str, Any]) -> None:
+        """Store a freshly generated token (login callback)."""
+        token_info = dict(token_info)
+        if "expires_in" in token_info:
+            token_info["expired_ts"] = int(time.time()) + int(token_info["expires_in"])
+        self._doc(uid).set(token_info)
+        self.cache.set(uid, token_info)
+
+    def delete(self, uid: str) -> None:
+        if self.writer:
+            self.writer.discard(uid)
+        self._doc(uid).delete()
+        self.cache.delete(uid)
+
+
+def get_token_store() -> TokenStore:
+    """Return the process-wide token store, shared by every endpoint.
+
+    One store means one memory cache and one write-behind queue per
+    process, so a token refreshed by one endpoint but not yet flushed is
+    seen by the others instead of being refreshed again.
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TokenStore(lambda: get_firestore_db())
+    return _store
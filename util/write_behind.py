@@ -0,0 +1,108 @@
+import atexit
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+# Seconds between flushes of queued token updates. 0 keeps writes
+# synchronous, which serverless deployments need since the process may be
+# frozen right after the response.
+TOKEN_WRITE_BEHIND_INTERVAL = float(os.getenv("TOKEN_WRITE_BEHIND_INTERVAL", "0"))
+# Firestore rejects batches with more than 500 writes
+MAX_BATCH_WRITES = 500
+
+logger = logging.getLogger("spotify-profile")
+
+
+class WriteBehindQueue:
+    """Coalesce document updates per id and flush them in batch writes.
+
+    Later updates for an id are merged into the pending one, so a burst of
+    refreshes costs a single write. Pending data is flushed every
+    ``interval`` seconds and at interpreter exit.
+    """
+
+    def __init__(
+        self,
+        get_db: Callable[[], Any],
+        collection: str = "users",
+        interval: float = TOKEN_WRITE_BEHIND_INTERVAL,
+    ):
+        self.get_db = get_db
+        self.collection = collection
+        self.interval = interval
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._stop = threading.Event()
+        atexit.register(self.flush)
+
+    def put(self, doc_id: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._pending.setdefault(doc_id, {}).update(data)
+        self._start()
+
+    def pending(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        """Return the update queued for ``doc_id`` that isn't flushed yet."""
+        with self._lock:
+            data = self._pending.get(doc_id)
+            return dict(data) if data is not None else None
+
+    def discard(self, doc_id: str) -> None:
+        with self._lock:
+            self._pending.pop(doc_id, None)
+
+    def flush(self) -> int:
+        """Write every pending update; return the number of documents written."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        items = list(pending.items())
+        written = 0
+        try:
+            db = self.get_db()
+            for start in range(0, len(items), MAX_BATCH_WRITES):
+                batch = db.batch()
+                chunk = items[start : start + MAX_BATCH_WRITES]
+                for doc_id, data in chunk:
+                    ref = db.collection(self.collection).document(doc_id)
+                    batch.set(ref, data, merge=True)
+                batch.commit()
+                written += len(chunk)
+        except Exception:  # noqa: BLE001
+            logger.exception("write-behind flush failed")
+            # Requeue what wasn't written, without clobbering newer updates
+            with self._lock:
+                for doc_id, data in items[written:]:
+                    self._pending[doc_id] = dict(data, **self._pending.get(doc_id, {}))
+        return written
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def _start(self) -> None:
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.flush()
+
+
+def create_write_behind_queue(get_db: Callable[[], Any]):
+    """Return a write-behind queue, or ``None`` when writes are synchronous."""
+    if TOKEN_WRITE_BEHIND_INTERVAL <= 0:
+        return None
+    return WriteBehindQueue(get_db)